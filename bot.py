@@ -1,10 +1,18 @@
-from typing import Mapping
+from __future__ import annotations
+from typing import Iterable, Mapping, Optional
+import asyncio
+import importlib
+import os
+import time
 import traceback
 
 import disnake
 from disnake.ext import commands, tasks
 
 import db
+from cogs.utils.paginator import StatelessPaginator
+from cogs.utils.text import get_morph
+from cogs.utils.waiters import WaiterRegistry
 
 initial_extensions = (
     "cogs.colors",
@@ -13,38 +21,154 @@ initial_extensions = (
     "cogs.valentines",
     "jishaku",
 )
+# not needed to serve commands, loaded in the background once the bot is ready
+deferred_extensions = ("jishaku",)
+# gateway intents each extension relies on, on top of `guilds`
+extension_intents: Mapping[str, tuple[str, ...]] = {
+    # ;colorfix is a prefix command
+    "cogs.colors": ("members", "guild_messages", "message_content"),
+    "cogs.voice_rooms": ("voice_states",),
+    "cogs.score": ("guild_messages",),
+    # ;send runs in DMs, ;deliveries in the guild too
+    "cogs.valentines": ("dm_messages", "dm_reactions", "guild_messages", "message_content"),
+    "jishaku": ("guild_messages", "dm_messages", "message_content"),
+}
+
+
+def lean_intents(extensions: Iterable[str]) -> disnake.Intents:
+    """Minimal intents for the given extensions, unknown ones get everything."""
+    names = {"guilds"}
+    for ext in extensions:
+        if ext not in extension_intents:
+            return disnake.Intents.all()
+        names.update(extension_intents[ext])
+    return disnake.Intents(**dict.fromkeys(names, True))
 
 
 class Bot(commands.Bot):
     def __init__(self):
+        # LEAN=0 brings back all intents with the full member cache
+        lean = os.environ.get("LEAN", "1") != "0"
+        if lean:
+            intents = lean_intents(initial_extensions)
+        else:
+            intents = disnake.Intents.all()
+        member_cache_flags = disnake.MemberCacheFlags.from_intents(intents)
+        if lean:
+            # `members` is there for guild.fetch_members, not for keeping everyone in memory
+            member_cache_flags.joined = False
         super().__init__(
             command_prefix=";",
             description="смешной ботик теперь перекованный",
             test_guilds=[
                 824997091075555419,
             ],  # 859290967475879966
-            intents=disnake.Intents.all(),
-            debug_events=True,
+            intents=intents,
+            # in lean mode only members sitting in voice are cached
+            member_cache_flags=member_cache_flags,
+            chunk_guilds_at_startup=not lean,
+            debug_events=os.environ.get("DEBUG_EVENTS") == "1",
         )
         self.startup = disnake.utils.utcnow()
         self.defer_pool: Mapping[int, disnake.Interaction] = {}
+        # one dispatcher for every stateless paginator, like a persistent view
+        self.paginator = StatelessPaginator()
+        self.add_listener(self.paginator.dispatch, "on_button_click")
+        self.waiters = WaiterRegistry()
+        self.waiters.setup(self)
+        # cog name -> task writing out the buffers of its unloaded instance
+        self.draining: dict[str, asyncio.Task] = {}
+        # extension -> (import seconds, setup seconds)
+        self.extension_timings: dict[str, tuple[float, float]] = {}
+        self.ready_after: Optional[float] = None
+        self.first_command_after: Optional[float] = None
+        self._started = time.perf_counter()
+        self._deferred_loaded = False
+        self.add_listener(self._record_first_command, "on_application_command")
 
         for ext in initial_extensions:
+            if ext not in deferred_extensions:
+                self.load_timed_extension(ext)
+
+    def load_timed_extension(self, ext: str, *, imported: float = 0.0) -> None:
+        try:
+            started = time.perf_counter()
+            importlib.import_module(ext)
+            imported += time.perf_counter() - started
+
+            started = time.perf_counter()
+            self.load_extension(ext)
+            self.extension_timings[ext] = (imported, time.perf_counter() - started)
+        except Exception as e:
+            tb = "\n".join(traceback.format_exception(None, e, e.__traceback__))
+            print(
+                f"Could not load extension {ext} due to {e.__class__.__name__}: {e}"
+            )
+            print(tb)
+
+    async def load_deferred(self) -> None:
+        for ext in deferred_extensions:
+            started = time.perf_counter()
+            try:
+                # heavy imports happen off the event loop
+                await self.loop.run_in_executor(None, importlib.import_module, ext)
+            except Exception:
+                pass  # reported by load_timed_extension
+            self.load_timed_extension(ext, imported=time.perf_counter() - started)
+        await self.loop.run_in_executor(None, get_morph)
+
+    def startup_report(self) -> str:
+        lines = [
+            f"{ext}: import {imported*1000:.0f}ms, setup {setup*1000:.0f}ms"
+            for ext, (imported, setup) in self.extension_timings.items()
+        ]
+        if self.ready_after is not None:
+            lines.append(f"ready after {self.ready_after:.2f}s")
+        if self.first_command_after is not None:
+            lines.append(f"first command after {self.first_command_after:.2f}s")
+        return "\n".join(lines)
+
+    async def _record_first_command(self, _: disnake.ApplicationCommandInteraction) -> None:
+        if self.first_command_after is None:
+            self.first_command_after = time.perf_counter() - self._started
+
+    async def start(self, *args, **kwargs) -> None:
+        # cogs wait for ready before touching the database, so it's set up by then
+        await db.init()
+        self.db_health.start()
+        await super().start(*args, **kwargs)
+
+    @tasks.loop(minutes=1)
+    async def db_health(self):
+        if await db.check():
+            print("Database connection was lost, reconnected")
+
+    async def wait_drained(self, name: str) -> None:
+        """Wait until the previous instance of a reloaded cog wrote out its buffers."""
+        task = self.draining.pop(name, None)
+        if task is not None:
+            await asyncio.wait({task})
+
+    async def close(self) -> None:
+        # let cogs write out their buffers while the database is still there
+        for name, cog in tuple(self.cogs.items()):
+            drain = getattr(cog, "drain", None)
+            if drain is None:
+                continue
             try:
-                self.load_extension(ext)
+                await drain()
             except Exception as e:
-                tb = "\n".join(traceback.format_exception(None, e, e.__traceback__))
-                print(
-                    f"Could not load extension {ext} due to {e.__class__.__name__}: {e}"
-                )
-                print(tb)
-
-        self.db_refresh.loop = self.loop
-        self.db_refresh.start()
-    
-    @tasks.loop(hours=2)
-    async def db_refresh(self):
-        await db.init(reconnect=True, regenerate=True)
+                print(f"Could not drain cog {name} due to {e.__class__.__name__}: {e}")
+                traceback.print_exception(type(e), e, e.__traceback__)
+        await super().close()
+        self.db_health.cancel()
+        await db.close()
 
     async def on_ready(self):
         print(f"Logged on as {self.user} (ID: {self.user.id})")
+        if self._deferred_loaded:
+            return
+        self._deferred_loaded = True
+        self.ready_after = time.perf_counter() - self._started
+        await self.load_deferred()
+        print(self.startup_report())
@@ -1,9 +1,13 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING
+import asyncio
+import time
+from typing import TYPE_CHECKING, Callable, Optional
 
 from disnake.ext import commands
 import disnake
 
+from .utils.ratelimit import RateLimiter
+
 if TYPE_CHECKING:
     from bot import Bot
 
@@ -44,21 +48,82 @@ class ColorButton(disnake.ui.Button["ColorView"]):
         super().__init__(custom_id=str(color[0]), emoji=color[2])
 
     async def callback(self, interaction: GuildMessageInteraction):
-        if int(self.custom_id) in interaction.author._roles:
-            await interaction.author.remove_roles(disnake.Object(self.custom_id))
+        await interaction.response.defer()
+        assert self.view is not None
+        self.view.updates.pick(interaction, int(self.custom_id))
+
+class ColorUpdates:
+    """Applies color picks with a single member edit per burst of clicks.
+
+    Every click moves the member's deadline, only the last pick is sent
+    once they stop clicking for ``delay`` seconds.
+    """
+    def __init__(self, delay: float = 1.5) -> None:
+        self.delay = delay
+        # member id -> (latest interaction, wanted color or None, deadline)
+        self.pending: dict[int, tuple[GuildMessageInteraction, Optional[int], float]] = {}
+        # colors already picked but not applied yet, so toggling sees them
+        self.wanted: dict[int, Optional[int]] = {}
+        # colors sent by the running task, the interaction's member still has the roles from click time
+        self.applied: dict[int, Optional[int]] = {}
+        self.tasks: dict[int, asyncio.Task] = {}
+
+    def current(self, member: disnake.Member) -> Optional[int]:
+        if member.id in self.wanted:
+            return self.wanted[member.id]
+        return next((role_id for role_id in member._roles if role_id in COLORS_SNOWFLAKE_SET), None)
+
+    def pick(self, interaction: GuildMessageInteraction, color: int) -> None:
+        member = interaction.author
+        # clicking the current color takes it off
+        wanted = None if self.current(member) == color else color
+        self.wanted[member.id] = wanted
+        self.pending[member.id] = (interaction, wanted, asyncio.get_running_loop().time() + self.delay)
+        if member.id not in self.tasks:
+            self.tasks[member.id] = asyncio.create_task(self.run(member.id))
+
+    async def run(self, member_id: int) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while member_id in self.pending:
+                deadline = self.pending[member_id][2]
+                if loop.time() < deadline:
+                    await asyncio.sleep(deadline - loop.time())
+                    continue
+                interaction, wanted, _ = self.pending.pop(member_id)
+                try:
+                    await self.apply(interaction.author, wanted)
+                except disnake.HTTPException:
+                    await interaction.followup.send('Не получилось сменить цвет, попробуйте ещё раз.', ephemeral=True)
+        finally:
+            del self.tasks[member_id]
+            self.applied.pop(member_id, None)
+            if member_id not in self.pending:
+                self.wanted.pop(member_id, None)
+
+    async def apply(self, member: disnake.Member, color: Optional[int]) -> None:
+        roles = [role_id for role_id in member._roles if role_id not in COLORS_SNOWFLAKE_SET]
+        if color is not None:
+            roles.append(color)
+        if member.id in self.applied:
+            if self.applied[member.id] == color:
+                return
+        elif set(roles) == set(member._roles):
             return
+        await member.edit(roles=[disnake.Object(role_id) for role_id in roles])
+        self.applied[member.id] = color
 
-        to_remove = COLORS_SNOWFLAKE_SET.intersection(interaction.author._roles)
-        await interaction.author.add_roles(disnake.Object(self.custom_id))
-        if to_remove:
-            await interaction.author.remove_roles(*(disnake.Object(role_id) for role_id in to_remove))
-        await interaction.response.defer()
+    def stop(self) -> None:
+        for task in self.tasks.values():
+            task.cancel()
+        self.pending.clear()
 
 class ColorView(disnake.ui.View):
     def __init__(self, *, bot: Bot = None):
         super().__init__(timeout=None)
         for color in COLORS:
             self.add_item(ColorButton(color))
+        self.updates = ColorUpdates()
 
         if bot is None:
             self.stop()
@@ -66,18 +131,143 @@ class ColorView(disnake.ui.View):
         self.bot = bot
 
 
+def color_plan(
+    retire: Optional[int] = None, replacement: Optional[int] = None
+) -> Callable[[disnake.Member], Optional[list[int]]]:
+    """Wanted role ids of a member, or None when they're fine.
+
+    Members keep only the topmost color, ``retire`` is swapped for ``replacement`` or taken off.
+    """
+    def plan(member: disnake.Member) -> Optional[list[int]]:
+        colors = [role.id for role in member.roles if role.id in COLORS_SNOWFLAKE_SET]
+        keep = colors[-1:]
+        if retire is not None and keep == [retire]:
+            keep = [replacement] if replacement is not None else []
+        if keep == colors:
+            return None
+        return [role_id for role_id in member._roles if role_id not in COLORS_SNOWFLAKE_SET] + keep
+    return plan
+
+class ColorFix:
+    """Guild-wide color roles cleanup.
+
+    Members are streamed from the API into a bounded queue, a few workers
+    apply the edits through a shared rate limiter.
+    """
+    def __init__(
+        self,
+        guild: disnake.Guild,
+        plan: Callable[[disnake.Member], Optional[list[int]]],
+        *,
+        dry_run: bool,
+        workers: int = 4,
+    ) -> None:
+        self.guild = guild
+        self.plan = plan
+        self.dry_run = dry_run
+        self.workers = workers
+        self.queue: asyncio.Queue[tuple[disnake.Member, list[int]]] = asyncio.Queue(maxsize=workers * 2)
+        self.limiter = RateLimiter(5, 5)
+        self.checked = self.needed = self.done = self.failed = 0
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+
+    async def produce(self) -> None:
+        async for member in self.guild.fetch_members(limit=None):
+            self.checked += 1
+            roles = self.plan(member)
+            if roles is None:
+                continue
+            self.needed += 1
+            if not self.dry_run:
+                await self.queue.put((member, roles))
+
+    async def work(self) -> None:
+        while True:
+            member, roles = await self.queue.get()
+            try:
+                await self.limiter.acquire()
+                await member.edit(roles=[disnake.Object(role_id) for role_id in roles], reason="Чистка цветов")
+                self.done += 1
+            except disnake.HTTPException:
+                self.failed += 1
+            finally:
+                self.queue.task_done()
+
+    async def run(self) -> None:
+        workers = [asyncio.create_task(self.work()) for _ in range(self.workers)]
+        try:
+            await self.produce()
+            await self.queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            self.finished = time.monotonic()
+
+    def report(self) -> str:
+        elapsed = max((self.finished or time.monotonic()) - self.started, 1e-3)
+        text = f"{'Проверка' if self.dry_run else 'Чистка'} цветов: проверено {self.checked}, нужно изменить {self.needed}"
+        if not self.dry_run:
+            text += f", изменено {self.done}, ошибок {self.failed}"
+        text += f"\n{self.checked / elapsed:.0f} участн./с"
+        if not self.dry_run:
+            text += f", {self.done / elapsed:.2f} изм./с"
+        text += f", {elapsed:.0f} с"
+        if self.finished is not None:
+            text += ". Готово."
+        return text
+
+
 class ColorChanger(commands.Cog, name="Цвета"):  # type: ignore
     def __init__(self, bot: Bot) -> None:
         self.bot = bot
+        self.fix: Optional[ColorFix] = None
+        self.fix_task: Optional[asyncio.Task] = None
 
     async def cog_load(self):
-        await self.bot.wait_until_ready()
-
+        # persistent views don't need the gateway, so buttons work as soon as we connect
         self.view = ColorView(bot=self.bot)
         self.bot.add_view(self.view)
 
     def cog_unload(self) -> None:
         self.view.stop()
+        self.view.updates.stop()
+        if self.fix_task is not None:
+            self.fix_task.cancel()
+
+    @commands.command(name="colorfix")
+    @commands.is_owner()
+    @commands.guild_only()
+    async def colorfix(
+        self,
+        ctx: commands.Context,
+        mode: str = "dry",
+        retire: Optional[disnake.Role] = None,
+        replacement: Optional[disnake.Role] = None,
+    ):
+        """Оставить всем по одному цвету, снять или заменить цвет retire.
+
+        dry только считает, run меняет роли.
+        """
+        if mode not in ("dry", "run"):
+            return await ctx.reply("`;colorfix dry|run [цвет] [замена]`")
+        if any(role is not None and role.id not in COLORS_SNOWFLAKE_SET for role in (retire, replacement)):
+            return await ctx.reply("Это не цвет.")
+        if self.fix_task is not None and not self.fix_task.done():
+            return await ctx.reply(f"Уже идёт.\n{self.fix.report()}")  # type: ignore
+
+        assert ctx.guild is not None
+        self.fix = fix = ColorFix(
+            ctx.guild,
+            color_plan(retire and retire.id, replacement and replacement.id),
+            dry_run=mode == "dry",
+        )
+        self.fix_task = task = asyncio.create_task(fix.run())
+        message = await ctx.reply(fix.report())
+        while not task.done():
+            await asyncio.wait({task}, timeout=5)
+            await message.edit(content=fix.report())
+        await task
 
 
 def setup(bot):
@@ -1,22 +1,45 @@
 from __future__ import annotations
+from bisect import bisect_left, insort
 import asyncio
+import os
+import traceback
 from math import log
-from dataclasses import dataclass
-from datetime import datetime, timedelta
-from typing import TYPE_CHECKING, Optional
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Callable, Optional
 
-from disnake.ext import commands
+from disnake.ext import commands, tasks
 import disnake
 from disnake.utils import utcnow
+from sortedcontainers import SortedList  # type: ignore
+from tortoise.expressions import F
+from tortoise.functions import Sum
+from tortoise.transactions import in_transaction
 
-from db.models import Score as ScoreModel, Member as MemberModel
+import db
+from db.models import Score as ScoreModel, Member as MemberModel, ScoreDay as ScoreDayModel
 from .utils.text import plural  # type: ignore
+from .utils.journal import Journal
+from .utils.paginator import PaginatorView, BaseListSource
 
 if TYPE_CHECKING:
     from bot import Bot
 
 B1 = 10
 Q = 2
+IDLE = timedelta(seconds=60)
+SWEEP_INTERVAL = 5
+FLUSH_SIZE = 50
+FLUSH_INTERVAL = 30
+COMPACT_AGE = timedelta(days=2)
+COMPACT_CHUNK = 500
+COMPACT_MAX_CHUNKS = 20
+PERIODS = {"day": 1, "week": 7, "month": 30}
+PERIOD_TITLES = {"day": "За последние сутки", "week": "За неделю", "month": "За месяц"}
+TOP_SIZE = 100
+AROUND_RADIUS = 5
+JOURNAL_PATH = os.environ.get("SCORE_JOURNAL", "db/files/score.journal")
+JOURNAL_SYNC = 1
 
 def _count_level(points: int) -> float:
     if points < B1:
@@ -26,19 +49,121 @@ def _count_level(points: int) -> float:
     res = log(points / B1) / log(Q)
     return res + 1
 
+def _from_ts(timestamp: float) -> datetime:
+    return datetime.fromtimestamp(timestamp, timezone.utc)
+
 def _count_score(level: int) -> int:
     if level <= 0:
         return 0
     return B1 * Q**(level-1)
 
-@dataclass
+class ScoreStats:
+    """Materialized aggregate of member's score rows.
+
+    Updated on every written row, so reading it never touches the database.
+    """
+    __slots__ = ("total", "level", "day_total", "recent", "days")
+
+    def __init__(self, total: int = 0) -> None:
+        self.total = total
+        self.level = int(_count_level(total))
+        self.day_total = 0
+        # (started_at, score) of rows inside the 24h window, sorted by started_at
+        self.recent: list[tuple[datetime, int]] = []
+        # rollup buckets of the last PERIODS["month"] days
+        self.days: dict[date, int] = {}
+
+    def add(self, started_at: datetime, score: int) -> None:
+        self.total += score
+        self.level = int(_count_level(self.total))
+        self.add_recent(started_at, score)
+        self.add_day(started_at.date(), score)
+
+    def add_recent(self, started_at: datetime, score: int) -> None:
+        since = utcnow() - timedelta(1)
+        # members nobody looks at never call day(), drop old rows here as well
+        self.prune(since)
+        if started_at >= since:
+            insort(self.recent, (started_at, score))
+            self.day_total += score
+
+    def add_day(self, day: date, score: int) -> None:
+        self.days[day] = self.days.get(day, 0) + score
+        if len(self.days) > PERIODS["month"]:
+            oldest = utcnow().date() - timedelta(PERIODS["month"])
+            for key in [key for key in self.days if key <= oldest]:
+                del self.days[key]
+
+    def prune(self, since: datetime) -> None:
+        idx = bisect_left(self.recent, (since,))
+        if idx:
+            self.day_total -= sum(score for _, score in self.recent[:idx])
+            del self.recent[:idx]
+
+    def day(self, now: datetime) -> int:
+        self.prune(now - timedelta(1))
+        return self.day_total
+
+    def period(self, now: datetime, days: int) -> int:
+        """Sum of the rollup buckets of the last ``days`` calendar days."""
+        today = now.date()
+        return sum(self.days.get(today - timedelta(i), 0) for i in range(days))
+
+
+class Leaderboard:
+    """Members ranked by lifetime score.
+
+    All lookups are logarithmic in the amount of ranked members.
+    """
+    def __init__(self) -> None:
+        # (-total, member_id), so the best member is at index 0
+        self._ranked = SortedList()
+        self._totals: dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._ranked)
+
+    def update(self, member_id: int, total: int) -> None:
+        old = self._totals.get(member_id)
+        if old is not None:
+            self._ranked.remove((-old, member_id))
+        self._totals[member_id] = total
+        self._ranked.add((-total, member_id))
+
+    def rank(self, member_id: int) -> Optional[int]:
+        """0-based place of the member, ``None`` if they have no score."""
+        total = self._totals.get(member_id)
+        if total is None:
+            return None
+        return self._ranked.index((-total, member_id))
+
+    def slice(self, start: int, stop: int) -> list[tuple[int, int, int]]:
+        """``(place, member_id, total)`` for places in ``[start, stop)``."""
+        start = max(start, 0)
+        return [
+            (place, member_id, -neg_total)
+            for place, (neg_total, member_id) in enumerate(self._ranked.islice(start, stop), start)
+        ]
+
+    def top(self, n: int) -> list[tuple[int, int, int]]:
+        return self.slice(0, n)
+
+    def around(self, member_id: int, radius: int) -> list[tuple[int, int, int]]:
+        place = self.rank(member_id)
+        if place is None:
+            return []
+        return self.slice(place - radius, place + radius + 1)
+
+
 class ScoreRow:
-    if TYPE_CHECKING:
-        cog: Score
-    member: disnake.Member
-    started_at: datetime
-    task: asyncio.Task = None  # type: ignore
-    ended_at: Optional[datetime] = None
+    """In-progress chat session of a member."""
+    __slots__ = ("member_id", "started_at", "last_seen", "ended_at")
+
+    def __init__(self, member_id: int, started_at: datetime) -> None:
+        self.member_id = member_id
+        self.started_at = started_at
+        self.last_seen = started_at
+        self.ended_at: Optional[datetime] = None
 
     @property
     def count(self) -> int:
@@ -47,32 +172,69 @@ class ScoreRow:
 
         return max(round((self.ended_at - self.started_at).total_seconds() / 60), 0)
 
-    async def finalize(self):
-        self.cog.row_mapping.pop(self.member.id)
-        if len(self.cog.row_mapping) > 0:
-            await ScoreModel.create(
-                member=(await MemberModel.get_or_create(id=self.member.id))[0],
-                score=self.count,
-                started_at=self.started_at,
-                ended_at=self.ended_at,
-            )
 
-    async def _task(self):
-        await asyncio.sleep(60)
+class ScoreWriter:
+    """Write-behind buffer for finalized sessions.
 
-        if len(self.cog.row_mapping) <= 2:
-            rows = list(self.cog.row_mapping.values())
-            started_at = max([r.started_at for r in rows])
-            for row in rows:
-                row.started_at = started_at
-                row.ended_at = utcnow()
-                if row.member.id != self.member.id:
-                    row.task.cancel()
-                await row.finalize()
-                return
+    Rows are inserted with ``bulk_create`` in one transaction once
+    ``FLUSH_SIZE`` of them piled up or by the periodic flush.
+    """
+    def __init__(self) -> None:
+        self.pending: list[ScoreModel] = []
+        self.known_members: set[int] = set()
+        self.lock = asyncio.Lock()
+        # called under the lock after every flush, rows in ``pending`` are all that's not written yet
+        self.on_flush: Optional[Callable[[], None]] = None
 
-        self.ended_at = utcnow() - timedelta(seconds=60)
-        await self.finalize()
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    async def load(self) -> None:
+        self.known_members = set(await MemberModel.all().using_db(db.reader()).values_list("id", flat=True))
+
+    def put(self, row: ScoreRow) -> ScoreModel:
+        db_row = ScoreModel(
+            member_id=row.member_id,
+            score=row.count,
+            started_at=row.started_at,
+            ended_at=row.ended_at,
+        )
+        self.pending.append(db_row)
+        return db_row
+
+    async def flush(self) -> None:
+        async with self.lock:
+            if not self.pending:
+                self.flushed()
+                return
+            rows, self.pending = self.pending, []
+            new_members = {row.member_id for row in rows} - self.known_members
+            days: dict[tuple[int, date], int] = {}
+            for row in rows:
+                key = (row.member_id, row.started_at.date())
+                days[key] = days.get(key, 0) + row.score
+            try:
+                async with in_transaction("master"):
+                    # rare, most sessions belong to members seen before
+                    for member_id in new_members:
+                        await MemberModel.get_or_create(id=member_id)
+                    await ScoreModel.bulk_create(rows)
+                    for (member_id, day), score in days.items():
+                        updated = await ScoreDayModel.filter(member_id=member_id, day=day).update(
+                            score=F("score") + score
+                        )
+                        if not updated:
+                            await ScoreDayModel.create(member_id=member_id, day=day, score=score)
+            except Exception:
+                # keep them for the next flush
+                self.pending[:0] = rows
+                raise
+            self.known_members |= new_members
+            self.flushed()
+
+    def flushed(self) -> None:
+        if self.on_flush is not None:
+            self.on_flush()
 
 
 class ScoreView(disnake.ui.View):
@@ -81,19 +243,24 @@ class ScoreView(disnake.ui.View):
         inter: disnake.CommandInteraction,
         *,
         member: disnake.Member,
-        rows: list[ScoreModel],
+        stats: ScoreStats,
     ):
         super().__init__(timeout=180)
         self.init_inter = inter
         self.member = member
+        self.stats = stats
+        self.period = "day"
+        self.day_button.disabled = True
 
-        self.rows = rows
-        now = inter.created_at - timedelta(1)
-        self.day_rows = list(filter(lambda x: x.started_at >= now, rows))
+    def period_score(self) -> int:
+        now = self.init_inter.created_at
+        if self.period == "day":
+            return self.stats.day(now)
+        return self.stats.period(now, PERIODS[self.period])
 
     def embed(self):
-        score = sum([r.score for r in self.rows])
-        level = int(_count_level(score))
+        score = self.stats.total
+        level = self.stats.level
         previous_frontier = _count_score(level)
         next_frontier = _count_score(level+1)
         percent = (score - previous_frontier) / (next_frontier - previous_frontier)
@@ -118,10 +285,10 @@ class ScoreView(disnake.ui.View):
                 "До следующего уровня", f'```diff\n+ {plural("очко"):{next_frontier-score}}\n```'
             )
         )
-        if self.day_rows:
+        if self.period in PERIODS:
             e.add_field(
-                "За последние сутки",
-                f"```md\n# {plural('очко'):{sum([r.score for r in self.day_rows])}}\n```",
+                PERIOD_TITLES[self.period],
+                f"```md\n# {plural('очко'):{self.period_score()}}\n```",
                 inline=False,
             )
         e.add_field(
@@ -137,60 +304,321 @@ class ScoreView(disnake.ui.View):
         await interaction.response.send_message("это не для тебя", ephemeral=True)
         return False
 
-    @disnake.ui.button(label="Index")
-    async def index_button(
-        self, button: disnake.ui.Button, inter: disnake.MessageInteraction
+    async def switch_period(
+        self, period: str, button: disnake.ui.Button, inter: disnake.MessageInteraction
     ):
         for b in self.children:
             if isinstance(b, disnake.ui.Button):
                 b.disabled = False
         button.disabled = True
-        await inter.response.send_message("soon (tm)", ephemeral=True, view=self)
+        self.period = period
+        await inter.response.edit_message(embed=self.embed(), view=self)
 
-    @disnake.ui.button(label="Mouth")
-    async def m_button(
+    @disnake.ui.button(label="Сутки")
+    async def day_button(
         self, button: disnake.ui.Button, inter: disnake.MessageInteraction
     ):
-        for b in self.children:
-            if isinstance(b, disnake.ui.Button):
-                b.disabled = False
-        button.disabled = True
-        await inter.response.send_message("soon (tm)", ephemeral=True, view=self)
+        await self.switch_period("day", button, inter)
 
-    @disnake.ui.button(label="All")
-    async def t_button(
+    @disnake.ui.button(label="Неделя")
+    async def week_button(
         self, button: disnake.ui.Button, inter: disnake.MessageInteraction
     ):
-        for b in self.children:
-            if isinstance(b, disnake.ui.Button):
-                b.disabled = False
-        button.disabled = True
-        await inter.response.send_message("soon (tm)", ephemeral=True, view=self)
+        await self.switch_period("week", button, inter)
+
+    @disnake.ui.button(label="Месяц")
+    async def month_button(
+        self, button: disnake.ui.Button, inter: disnake.MessageInteraction
+    ):
+        await self.switch_period("month", button, inter)
+
+    @disnake.ui.button(label="Всё время")
+    async def all_button(
+        self, button: disnake.ui.Button, inter: disnake.MessageInteraction
+    ):
+        await self.switch_period("all", button, inter)
+
+
+class TopSource(BaseListSource):
+    def __init__(self, author_id: int, entries: list[tuple[int, int, int]], *, place: Optional[int] = None):
+        super().__init__(entries, per_page=10)
+        self.author_id = author_id
+        self.place = place
+
+    async def format_page(self, menu: PaginatorView, page: list[tuple[int, int, int]]):
+        e = self.base_embed(menu, page)
+        if self.place is not None:
+            e.title = f"Ваше место: #{self.place+1}"
+        e.description = "\n".join(
+            f'{"**" if member_id == self.author_id else ""}'
+            f'`#{place+1}` <@{member_id}> — {plural("очко"):{total}}'
+            f'{"**" if member_id == self.author_id else ""}'
+            for place, member_id, total in page
+        )
+        return e
 
 
 class Score(commands.Cog):
     def __init__(self, bot: Bot):
         self.bot = bot
-        self.row_mapping: dict[int, ScoreRow] = {}
-        self.cache: dict[int, list[ScoreModel]] = {}
-        ScoreRow.cog = self
+        # ordered by last_seen, so idle sessions are always at the front
+        self.row_mapping: OrderedDict[int, ScoreRow] = OrderedDict()
+        self.cache: dict[int, ScoreStats] = {}
+        self.leaderboard = Leaderboard()
+        self.writer = ScoreWriter()
+        # open sessions and unwritten rows survive a crash through the journal
+        self.journal = Journal(JOURNAL_PATH)
+        self.restored = False
+        self.writer.on_flush = self.compact_journal
+
+    async def cog_load(self) -> None:
+        await self.bot.wait_until_ready()
+        # after a reload, the old instance's rows have to be written first
+        await self.bot.wait_drained(self.qualified_name)
+        await self.refresh()
+        await self.writer.load()
+        self.restore()
+        self.journal_sync.start()
+        self.sweeper.start()
+        self.flusher.start()
+        self.compactor.start()
+
+    def stats(self, member_id: int) -> ScoreStats:
+        try:
+            return self.cache[member_id]
+        except KeyError:
+            stats = self.cache[member_id] = ScoreStats()
+            return stats
+
+    def add_score(self, member_id: int, started_at: datetime, score: int) -> None:
+        stats = self.stats(member_id)
+        stats.add(started_at, score)
+        self.leaderboard.update(member_id, stats.total)
+
+    async def refresh(self) -> None:
+        """Rebuild the aggregates from the database.
+
+        Lifetime totals are summed by the database, only rows of the last day
+        and rollup buckets of the last month are loaded.
+        """
+        cache: dict[int, ScoreStats] = {}
+        reader = db.reader()
+        totals = await ScoreModel.filter(dumped=False).annotate(total=Sum("score")).group_by("member_id").using_db(
+            reader
+        ).values_list("member_id", "total")
+        for member_id, total in totals:
+            cache[member_id] = ScoreStats(total or 0)
+
+        day_rows = await ScoreModel.filter(dumped=False, started_at__gte=utcnow() - timedelta(1)).using_db(
+            reader
+        ).values_list("member_id", "started_at", "score")
+        for member_id, started_at, score in day_rows:
+            cache.setdefault(member_id, ScoreStats()).add_recent(started_at, score)
+
+        days = await ScoreDayModel.filter(
+            day__gt=utcnow().date() - timedelta(PERIODS["month"])
+        ).using_db(reader).values_list("member_id", "day", "score")
+        for member_id, day, score in days:
+            cache.setdefault(member_id, ScoreStats()).add_day(day, score)
+        self.cache = cache
+
+        leaderboard = Leaderboard()
+        for member_id, stats in cache.items():
+            leaderboard.update(member_id, stats.total)
+        self.leaderboard = leaderboard
+
+    def restore(self) -> None:
+        """Replay the journal left by the previous run.
+
+        Closed but unwritten sessions go back to the writer, open ones are
+        merged into ``row_mapping`` and expire as usual. An open one whose
+        member started a new session after more than ``IDLE`` is closed at its
+        last message instead.
+        """
+        open_rows: dict[int, ScoreRow] = {}
+        closed: list[ScoreRow] = []
+        for kind, member_id, *times in self.journal.replay():
+            if kind == "start":
+                open_rows[member_id] = ScoreRow(member_id, _from_ts(times[0]))
+            elif kind == "seen":
+                if member_id in open_rows:
+                    open_rows[member_id].last_seen = _from_ts(times[0])
+            elif kind == "close":
+                open_rows.pop(member_id, None)
+                started_at, ended_at, persist = times
+                if persist:
+                    row = ScoreRow(member_id, _from_ts(started_at))
+                    row.ended_at = _from_ts(ended_at)
+                    closed.append(row)
+
+        for row in closed:
+            db_row = self.writer.put(row)
+            self.add_score(db_row.member_id, db_row.started_at, db_row.score)
+        # sessions started while we were loading are newer
+        for row in open_rows.values():
+            live = self.row_mapping.get(row.member_id)
+            if live is None:
+                self.row_mapping[row.member_id] = row
+            elif live.started_at - row.last_seen <= IDLE:
+                # the same conversation, keep the earlier start
+                live.started_at = min(live.started_at, row.started_at)
+            else:
+                # went idle while we were down, close it like the sweeper would have
+                row.ended_at = row.last_seen
+                self.finalize([row])
+        self.row_mapping = OrderedDict(
+            (row.member_id, row) for row in sorted(self.row_mapping.values(), key=lambda row: row.last_seen)
+        )
+        self.restored = True
+        self.compact_journal()
 
+    def compact_journal(self) -> None:
+        """Rewrite the journal as the current state."""
+        if not self.restored:
+            # the old journal hasn't been read yet
+            return
+        events: list[tuple] = []
+        for row in self.row_mapping.values():
+            events.append(("start", row.member_id, row.started_at.timestamp()))
+            events.append(("seen", row.member_id, row.last_seen.timestamp()))
+        for db_row in self.writer.pending:
+            events.append(("close", db_row.member_id, db_row.started_at.timestamp(), db_row.ended_at.timestamp(), True))
+        self.journal.compact(events)
+
+    def finalize(self, rows: list[ScoreRow], *, persist: bool = True) -> None:
+        for row in rows:
+            if self.row_mapping.get(row.member_id) is row:
+                del self.row_mapping[row.member_id]
+            assert row.ended_at is not None
+            self.journal.append("close", row.member_id, row.started_at.timestamp(), row.ended_at.timestamp(), persist)
+        if not persist:
+            return
+        for row in rows:
+            db_row = self.writer.put(row)
+            self.add_score(db_row.member_id, db_row.started_at, db_row.score)
+
+    async def expire(self, rows: list[ScoreRow]) -> None:
+        for row in rows:
+            if row.member_id not in self.row_mapping:
+                # already closed together with its partner
+                continue
+
+            if len(self.row_mapping) <= 2:
+                # the conversation is over, close it for everyone at once
+                partners = list(self.row_mapping.values())
+                started_at = max(r.started_at for r in partners)
+                for partner in partners:
+                    partner.started_at = started_at
+                    partner.ended_at = row.last_seen + IDLE
+                self.finalize(partners, persist=len(partners) > 1)
+                continue
+
+            row.ended_at = row.last_seen
+            self.finalize([row])
+
+        if len(self.writer) >= FLUSH_SIZE:
+            await self.flush()
+
+    @tasks.loop(seconds=SWEEP_INTERVAL)
+    async def sweeper(self):
+        deadline = utcnow() - IDLE
+        expired = []
+        for row in self.row_mapping.values():
+            if row.last_seen > deadline:
+                break
+            expired.append(row)
+        if expired:
+            await self.expire(expired)
+
+    @tasks.loop(seconds=JOURNAL_SYNC)
+    async def journal_sync(self):
+        self.journal.sync()
+
+    async def flush(self) -> None:
+        # a failed loop iteration would stop the loop for good, rows stay pending for the next try
+        try:
+            await self.writer.flush()
+        except Exception as e:
+            print(f"Could not flush {len(self.writer)} score rows due to {e.__class__.__name__}: {e}")
+            traceback.print_exception(type(e), e, e.__traceback__)
+
+    @tasks.loop(seconds=FLUSH_INTERVAL)
+    async def flusher(self):
+        await self.flush()
+
+    async def compact_chunk(self) -> int:
+        """Fold up to ``COMPACT_CHUNK`` old rows into per member per day snapshots.
+
+        Snapshots are ``Score`` rows with ``snapshot`` set, they keep the score sum
+        and the bounds of the folded sessions. The originals stay as history with
+        ``dumped`` set and are left out of totals, so totals, levels and rollups
+        stay the same. Returns the amount of folded rows.
+        """
+        rows = await ScoreModel.filter(
+            dumped=False, snapshot=False, ended_at__lt=utcnow() - COMPACT_AGE
+        ).order_by("id").limit(COMPACT_CHUNK)
+        if not rows:
+            return 0
 
-    async def refresh(self, at=None) -> None:
-        rows: dict[int, list[ScoreModel]] = {}
-        ScoreModel.all().filter()
-        for row in await (ScoreModel.filter(ended_at__gt=at) if at else ScoreModel.all()):
-            if row.id in rows:
-                rows[row.member_id].append(row)
-            else:
-                rows[row.member_id] = [row]
-        self.cache = rows
+        snapshots: dict[tuple[int, date], ScoreModel] = {}
+        for row in rows:
+            key = (row.member_id, row.started_at.date())
+            snapshot = snapshots.get(key)
+            if snapshot is None:
+                snapshots[key] = ScoreModel(
+                    member_id=row.member_id,
+                    score=row.score,
+                    started_at=row.started_at,
+                    ended_at=row.ended_at,
+                    snapshot=True,
+                )
+                continue
+            snapshot.score += row.score
+            snapshot.started_at = min(snapshot.started_at, row.started_at)
+            snapshot.ended_at = max(snapshot.ended_at, row.ended_at)
+
+        async with in_transaction("master"):
+            await ScoreModel.filter(id__in=[row.id for row in rows]).update(dumped=True)
+            await ScoreModel.bulk_create(list(snapshots.values()))
+        return len(rows)
+
+    @tasks.loop(hours=1)
+    async def compactor(self):
+        for _ in range(COMPACT_MAX_CHUNKS):
+            try:
+                folded = await self.compact_chunk()
+            except Exception as e:
+                # the next hourly run picks it up, don't let the loop die
+                print(f"Score compaction failed due to {e.__class__.__name__}: {e}")
+                traceback.print_exception(type(e), e, e.__traceback__)
+                return
+            if folded < COMPACT_CHUNK:
+                return
+            # short transactions with pauses, so session writes are never held up
+            await asyncio.sleep(1)
+
+    def close_sessions(self) -> None:
+        rows = list(self.row_mapping.values())
+        now = utcnow()
+        for row in rows:
+            row.ended_at = now
+        self.finalize(rows, persist=len(rows) > 1)
+
+    async def drain(self) -> None:
+        """Close open sessions and write everything out, called by ``Bot.close``."""
+        self.close_sessions()
+        await self.writer.flush()
+        self.journal.sync()
+        self.journal.close()
 
     def cog_unload(self) -> None:
-        for row in self.row_mapping.values():
-            row.task.cancel()
-            row.ended_at = utcnow()
-            self.bot.loop.create_task(row.finalize())
+        self.journal_sync.cancel()
+        self.sweeper.cancel()
+        self.flusher.cancel()
+        self.compactor.cancel()
+        self.close_sessions()
+        self.journal.sync()
+        self.bot.draining[self.qualified_name] = self.bot.loop.create_task(self.drain())
 
     @commands.Cog.listener()
     async def on_message(self, message: disnake.Message):
@@ -201,16 +629,15 @@ class Score(commands.Cog):
         if not isinstance(message.author, disnake.Member):
             return
 
-        if message.author.id not in self.row_mapping:
-            row = ScoreRow(message.author, utcnow())
-            row.task = self.bot.loop.create_task(row._task())
-            self.row_mapping[message.author.id] = row
+        row = self.row_mapping.get(message.author.id)
+        if row is None:
+            row = self.row_mapping[message.author.id] = ScoreRow(message.author.id, utcnow())
+            self.journal.append("start", row.member_id, row.started_at.timestamp())
             return
 
-        row = self.row_mapping[message.author.id]
-        if not row.task.done():
-            row.task.cancel()
-            row.task = self.bot.loop.create_task(row._task())
+        row.last_seen = utcnow()
+        self.row_mapping.move_to_end(message.author.id)
+        self.journal.append("seen", row.member_id, row.last_seen.timestamp())
 
     @commands.slash_command()
     async def score(*_):
@@ -228,15 +655,31 @@ class Score(commands.Cog):
         ----------
         member: Участник, чьё кол-во очков хотите увидеть (вы, по умолчанию)
         """
-        rows = await ScoreModel.filter(member__id=member.id)
-        
-        view = ScoreView(inter, member=member, rows=rows)
+        view = ScoreView(inter, member=member, stats=self.cache.get(member.id) or ScoreStats())
         await inter.response.send_message(embed=view.embed(), view=view)
 
     @score.sub_command()
-    async def top(self, inter: disnake.CommandInteraction):
-        """Посмотреть топ по очкам"""
+    async def top(
+        self,
+        inter: disnake.CommandInteraction,
+        member: Optional[disnake.Member] = None,
+    ):
+        """Посмотреть топ по очкам
 
+        Parameters
+        ----------
+        member: Показать участников рядом с этим человеком
+        """
+        if member is None:
+            entries = self.leaderboard.top(TOP_SIZE)
+        else:
+            entries = self.leaderboard.around(member.id, AROUND_RADIUS)
+        if not entries:
+            return await inter.response.send_message("Тут пока никого нет.", ephemeral=True)
+
+        source = TopSource(inter.author.id, entries, place=self.leaderboard.rank(inter.author.id))
+        view = PaginatorView(source, interaction=inter)
+        await view.start()
     
 
 def setup(bot):
@@ -0,0 +1,178 @@
+import asyncio
+import traceback
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+import disnake
+from disnake.utils import utcnow
+from tortoise.functions import Count
+
+import db
+from db.models import Delivery
+from .cache import LRUCache
+from .ratelimit import RateLimiter
+
+MAX_ATTEMPTS = 8
+POLL_INTERVAL = 30
+
+
+class DeliveryQueue:
+    """Persistent outbound queue for DM notifications.
+
+    Deliveries are stored in the ``Delivery`` table first, so commands return
+    right away and nothing is lost on restart. A feeder picks due rows and a
+    few workers send them, paced by a global and a per-recipient rate limit.
+    Failed sends are retried with exponential backoff, closed DMs are not.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[Delivery], Awaitable[None]],
+        *,
+        workers: int = 4,
+        batch: int = 50,
+    ) -> None:
+        self.send = send
+        self.workers = workers
+        self.batch = batch
+        self.global_limit = RateLimiter(5, 1.0)
+        # DM channels allow 5 messages per 5 seconds
+        self.route_limits: LRUCache[int, RateLimiter] = LRUCache(1024)
+        self.queue: "asyncio.Queue[Delivery]" = asyncio.Queue(maxsize=batch)
+        self.in_flight: Set[int] = set()
+        self.wakeup = asyncio.Event()
+        self.tasks: List[asyncio.Task] = []
+        self.started_at = utcnow()
+        self.sent = 0
+
+    def start(self) -> None:
+        self.started_at = utcnow()
+        self.tasks = [asyncio.create_task(self.feeder())]
+        self.tasks += [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+
+    def stop(self) -> None:
+        # unfinished rows stay pending and are picked up after restart
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+
+    async def enqueue(self, valentine_id: int, recipient: int, *, at: Optional[datetime] = None) -> Delivery:
+        delivery, _ = await Delivery.get_or_create(
+            valentine_id=valentine_id,
+            recipient=recipient,
+            defaults={"next_attempt_at": at or utcnow()},
+        )
+        self.wakeup.set()
+        return delivery
+
+    async def enqueue_many(self, pairs: List[tuple], *, at: Optional[datetime] = None) -> None:
+        """Queue ``(valentine_id, recipient)`` pairs at once, already queued ones are skipped."""
+        if not pairs:
+            return
+        await Delivery.bulk_create(
+            [
+                Delivery(valentine_id=valentine_id, recipient=recipient, next_attempt_at=at or utcnow())
+                for valentine_id, recipient in pairs
+            ],
+            ignore_conflicts=True,
+        )
+        self.wakeup.set()
+
+    def pending(self):
+        query = Delivery.filter(status=Delivery.PENDING)
+        if self.in_flight:
+            query = query.exclude(id__in=self.in_flight)
+        return query
+
+    async def feeder(self) -> None:
+        while True:
+            self.wakeup.clear()
+            try:
+                rows = await self.pending().filter(next_attempt_at__lte=utcnow()).order_by("next_attempt_at").limit(
+                    self.batch
+                )
+                for row in rows:
+                    self.in_flight.add(row.id)
+                    await self.queue.put(row)
+                if len(rows) == self.batch:
+                    continue
+
+                next_at = await self.pending().order_by("next_attempt_at").first().values_list(
+                    "next_attempt_at", flat=True
+                )
+            except Exception as e:
+                print(f"Delivery feeder failed due to {e.__class__.__name__}: {e}")
+                next_at = None
+
+            timeout = float(POLL_INTERVAL)
+            if next_at is not None:
+                timeout = min(max((next_at - utcnow()).total_seconds(), 0.0), timeout)
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def worker(self) -> None:
+        while True:
+            row = await self.queue.get()
+            try:
+                await self.deliver(row)
+            except Exception as e:
+                print(f"Could not deliver {row.id} due to {e.__class__.__name__}: {e}")
+                traceback.print_exception(type(e), e, e.__traceback__)
+            finally:
+                self.in_flight.discard(row.id)
+
+    def route_limit(self, recipient: int) -> RateLimiter:
+        limiter = self.route_limits.get(recipient)
+        if limiter is None:
+            limiter = self.route_limits[recipient] = RateLimiter(5, 5.0)
+        return limiter
+
+    async def deliver(self, row: Delivery) -> None:
+        route = self.route_limit(row.recipient)
+        await self.global_limit.acquire()
+        await route.acquire()
+
+        row.attempts += 1
+        try:
+            await self.send(row)
+        except (disnake.Forbidden, disnake.NotFound) as e:
+            # closed DMs or a deleted account, retrying won't help
+            row.status = Delivery.FAILED
+            row.error = str(e)
+        except Exception as e:
+            row.error = f"{e.__class__.__name__}: {e}"
+            retry_after = getattr(e, "retry_after", None)
+            if retry_after:
+                route.retry_after(retry_after)
+            if row.attempts >= MAX_ATTEMPTS:
+                row.status = Delivery.FAILED
+            else:
+                row.next_attempt_at = utcnow() + timedelta(seconds=min(5 * 2 ** row.attempts, 3600))
+        else:
+            row.status = Delivery.SENT
+            row.sent_at = utcnow()
+            row.error = None
+            self.sent += 1
+        await row.save(update_fields=["status", "attempts", "next_attempt_at", "sent_at", "error"])
+
+    async def stats(self) -> Dict[str, float]:
+        """Backlog and throughput numbers."""
+        reader = db.reader()
+        now = utcnow()
+        counts = dict(
+            await Delivery.annotate(count=Count("id")).group_by("status").using_db(reader).values_list(
+                "status", "count"
+            )
+        )
+        uptime = max((now - self.started_at).total_seconds(), 1.0)
+        return {
+            **{status: counts.get(status, 0) for status in (Delivery.PENDING, Delivery.SENT, Delivery.FAILED)},
+            "due": await Delivery.filter(status=Delivery.PENDING, next_attempt_at__lte=now).using_db(reader).count(),
+            "in_flight": len(self.in_flight),
+            "sent_last_hour": await Delivery.filter(
+                status=Delivery.SENT, sent_at__gte=now - timedelta(hours=1)
+            ).using_db(reader).count(),
+            "per_minute": self.sent / uptime * 60,
+        }
@@ -0,0 +1,65 @@
+import json
+import os
+from typing import IO, Iterable, Iterator, Optional
+
+
+class Journal:
+    """Append-only file of JSON events.
+
+    Events are buffered in memory and written out with an fsync by ``sync``,
+    so a crash loses at most the events since the last sync. ``compact``
+    atomically replaces the file with a snapshot of the current state.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.buffer: list[str] = []
+        self.file: Optional[IO[str]] = None
+        # events written since the last compaction
+        self.appended = 0
+
+    def append(self, *event) -> None:
+        self.buffer.append(json.dumps(event, separators=(",", ":")))
+
+    def replay(self) -> Iterator[list]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        # torn write at the end of the file
+                        return
+        except FileNotFoundError:
+            return
+
+    def sync(self) -> None:
+        if not self.buffer:
+            return
+        if self.file is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.file = open(self.path, "a", encoding="utf-8")
+        lines, self.buffer = self.buffer, []
+        self.file.write("\n".join(lines) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.appended += len(lines)
+
+    def compact(self, events: Iterable[tuple]) -> None:
+        """Replace the file with ``events``, buffered events are dropped."""
+        tmp = self.path + ".tmp"
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(tmp, "w", encoding="utf-8") as f:
+            for event in events:
+                f.write(json.dumps(event, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.close()
+        os.replace(tmp, self.path)
+        self.buffer.clear()
+        self.appended = 0
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -1,8 +1,30 @@
 import asyncio
-from typing import Dict, Optional, Any
+from datetime import datetime, timedelta, timezone
+from math import ceil
+from types import SimpleNamespace
+from typing import Awaitable, Callable, Dict, List, Optional, Any, Tuple
 
 import disnake
 from disnake.ext import menus
+from tortoise.expressions import Q
+from tortoise.fields import DatetimeField
+from tortoise.queryset import QuerySet
+
+from .cache import LRUCache
+
+
+class _RenderContext:
+    """Stands in for the view while a page is rendered.
+
+    ``current_page`` is the page being rendered, which differs from the
+    shown one when the next page is rendered ahead of time.
+    """
+    def __init__(self, view: 'PaginatorView', page_number: int):
+        self._view = view
+        self.current_page = page_number
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._view, name)
 
 class PaginatorView(disnake.ui.View):
     def __init__(
@@ -12,6 +34,7 @@ class PaginatorView(disnake.ui.View):
         interaction: disnake.Interaction,
         check_embeds: bool = True,
         compact: bool = False,
+        cache_size: int = 5,
     ):
         super().__init__()
         self.source: menus.PageSource = source
@@ -21,6 +44,8 @@ class PaginatorView(disnake.ui.View):
         self.current_page: int = 0
         self.compact: bool = compact
         self.input_lock = asyncio.Lock()
+        self._rendered: LRUCache[int, Dict[str, Any]] = LRUCache(cache_size)
+        self._prefetch: Optional[asyncio.Task] = None
         self.clear_items()
         self.fill_items()
 
@@ -44,8 +69,9 @@ class PaginatorView(disnake.ui.View):
                 self.add_item(self.numbered_page)  # type: ignore
             self.add_item(self.stop_pages)  # type: ignore
 
-    async def _get_kwargs_from_page(self, page: int) -> Dict[str, Any]:
-        value = await disnake.utils.maybe_coroutine(self.source.format_page, self, page)
+    async def _get_kwargs_from_page(self, page: Any, page_number: Optional[int] = None) -> Dict[str, Any]:
+        menu = self if page_number is None else _RenderContext(self, page_number)
+        value = await disnake.utils.maybe_coroutine(self.source.format_page, menu, page)
         if isinstance(value, dict):
             return value
         elif isinstance(value, str):
@@ -55,10 +81,45 @@ class PaginatorView(disnake.ui.View):
         else:
             return {}
 
+    async def render(self, page_number: int) -> Dict[str, Any]:
+        kwargs = self._rendered.get(page_number)
+        if kwargs is None:
+            page = await self.source.get_page(page_number)
+            kwargs = await self._get_kwargs_from_page(page, page_number)
+            self._rendered[page_number] = kwargs
+        return kwargs
+
+    def invalidate(self, page_number: Optional[int] = None) -> None:
+        """Forget rendered pages, all of them by default, for sources whose data changed."""
+        if page_number is None:
+            self._rendered.clear()
+        else:
+            self._rendered.pop(page_number)
+        invalidate = getattr(self.source, 'invalidate', None)
+        if invalidate is not None:
+            invalidate(page_number)
+
+    async def _render_quietly(self, page_number: int) -> None:
+        try:
+            await self.render(page_number)
+        except Exception:
+            # it will be rendered again when actually requested
+            pass
+
+    def prefetch(self, page_number: int) -> None:
+        max_pages = self.source.get_max_pages()
+        if page_number < 0 or (max_pages is not None and page_number >= max_pages):
+            return
+        if page_number in self._rendered:
+            return
+        if self._prefetch is not None and not self._prefetch.done():
+            self._prefetch.cancel()
+        self._prefetch = asyncio.create_task(self._render_quietly(page_number))
+
     async def show_page(self, interaction: disnake.Interaction, page_number: int) -> None:
-        page = await self.source.get_page(page_number)
+        previous_page = self.current_page
+        kwargs = await self.render(page_number)
         self.current_page = page_number
-        kwargs = await self._get_kwargs_from_page(page)
         self._update_labels(page_number)
         if kwargs:
             if interaction.response.is_done():
@@ -66,6 +127,8 @@ class PaginatorView(disnake.ui.View):
                     await self.message.edit(**kwargs, view=self)
             else:
                 await interaction.response.edit_message(**kwargs, view=self)
+        # keep going in the same direction, forward by default
+        self.prefetch(page_number - 1 if page_number < previous_page else page_number + 1)
 
     def _update_labels(self, page_number: int) -> None:
         self.go_to_first_page.disabled = page_number == 0
@@ -111,6 +174,8 @@ class PaginatorView(disnake.ui.View):
         return False
 
     async def on_timeout(self) -> None:
+        if self._prefetch is not None:
+            self._prefetch.cancel()
         if self.message:
             await self.message.edit(view=None)
 
@@ -126,11 +191,12 @@ class PaginatorView(disnake.ui.View):
             return
 
         await self.source._prepare_once()
-        page = await self.source.get_page(0)
-        kwargs = await self._get_kwargs_from_page(page)
+        kwargs = await self.render(0)
         self._update_labels(0)
         await self.interaction.response.send_message(**kwargs, view=self, ephemeral=ephemeral)
         self.message = await self.interaction.original_message()
+        if self.source.is_paginating():
+            self.prefetch(1)
 
     @disnake.ui.button(label='≪', style=disnake.ButtonStyle.grey)
     async def go_to_first_page(self, button: disnake.ui.Button, interaction: disnake.Interaction):
@@ -180,15 +246,14 @@ class PaginatorView(disnake.ui.View):
                 )
             )
 
-            def message_check(m):
-                return m.custom_id == f'{self.interaction.author.id}-{interaction.id}'
-
             try:
-                modal_inter: disnake.ModalInteraction = await self.interaction.bot.wait_for('modal_submit', check=message_check, timeout=30.0)
+                modal_inter: disnake.ModalInteraction = await self.interaction.bot.waiters.wait(
+                    ('modal', f'{self.interaction.author.id}-{interaction.id}'), timeout=30.0
+                )
             except asyncio.TimeoutError:
-                pass
+                return
 
-            if modal_inter and modal_inter.text_values['page'].isdigit():
+            if modal_inter.text_values['page'].isdigit():
                 await self.show_checked_page(modal_inter, int(modal_inter.text_values['page']) - 1)
             else:
                 await modal_inter.response.send_message('Это не число', ephemeral=True)
@@ -199,18 +264,292 @@ class PaginatorView(disnake.ui.View):
         await interaction.response.edit_message(view=None)
         self.stop()
 
-class BaseListSource(menus.ListPageSource):
+SourceFactory = Callable[[disnake.MessageInteraction, str], Awaitable[Optional[menus.PageSource]]]
+
+class StatelessPaginator:
+    """Paginator that keeps nothing in memory between button presses.
+
+    Buttons carry ``pg:<kind>:<key>:<action>:<page>:<cursor>`` custom ids. On
+    a press the factory registered for ``kind`` rebuilds the source from
+    ``key`` and the target page is rendered, so idle paginators cost nothing
+    and keep working after a restart. Factories return ``None`` to deny access.
+
+    Sources with ``cursors(page)`` and ``seek(page_number, cursor)`` get the
+    bounds of the shown page on the next and previous buttons, so stepping
+    through pages doesn't need an offset.
+    """
+    PREFIX = 'pg'
+
+    def __init__(self) -> None:
+        self.factories: Dict[str, SourceFactory] = {}
+
+    def register(self, kind: str, factory: SourceFactory) -> None:
+        self.factories[kind] = factory
+
+    def components(
+        self,
+        kind: str,
+        key: str,
+        page_number: int,
+        max_pages: int,
+        cursors: Tuple[str, str] = ('', ''),
+    ) -> List[disnake.ui.Button]:
+        def button(action: str, target: int, cursor: str = '', **kwargs) -> disnake.ui.Button:
+            return disnake.ui.Button(custom_id=f'{self.PREFIX}:{kind}:{key}:{action}:{target}:{cursor}', **kwargs)
+
+        if max_pages <= 1:
+            return []
+        last = max_pages - 1
+        return [
+            button('first', 0, label='≪', disabled=page_number == 0),
+            button(
+                'prev', page_number - 1, cursors[0], style=disnake.ButtonStyle.blurple,
+                label=str(page_number) if page_number > 0 else '…', disabled=page_number == 0,
+            ),
+            button('current', page_number, label=str(page_number + 1), disabled=True),
+            button(
+                'next', page_number + 1, cursors[1], style=disnake.ButtonStyle.blurple,
+                label=str(page_number + 2) if page_number < last else '…', disabled=page_number >= last,
+            ),
+            button('last', last, label='≫', disabled=page_number >= last),
+            button('stop', page_number, label='Стоп', style=disnake.ButtonStyle.red),
+        ]
+
+    async def render(self, kind: str, key: str, source: menus.PageSource, page_number: int) -> Dict[str, Any]:
+        max_pages = source.get_max_pages() or 1
+        page_number = min(max(page_number, 0), max_pages - 1)
+        page = await source.get_page(page_number)
+        # format_page only needs to know which page it renders
+        value = await disnake.utils.maybe_coroutine(
+            source.format_page, SimpleNamespace(current_page=page_number), page
+        )
+        if isinstance(value, str):
+            kwargs: Dict[str, Any] = {'content': value, 'embed': None}
+        elif isinstance(value, disnake.Embed):
+            kwargs = {'embed': value, 'content': None}
+        else:
+            kwargs = dict(value)
+        cursors = source.cursors(page) if hasattr(source, 'cursors') and page else ('', '')
+        kwargs['components'] = self.components(kind, key, page_number, max_pages, cursors)
+        return kwargs
+
+    async def send(
+        self,
+        interaction: disnake.Interaction,
+        kind: str,
+        key: str,
+        source: menus.PageSource,
+        *,
+        ephemeral: bool = False,
+    ) -> None:
+        await source._prepare_once()
+        kwargs = await self.render(kind, key, source, 0)
+        await interaction.response.send_message(**kwargs, ephemeral=ephemeral)
+
+    async def dispatch(self, interaction: disnake.MessageInteraction) -> None:
+        """``on_button_click`` listener."""
+        custom_id = interaction.component.custom_id or ''
+        if not custom_id.startswith(f'{self.PREFIX}:'):
+            return
+        _, kind, rest = custom_id.split(':', 2)
+        key, action, target, cursor = rest.rsplit(':', 3)
+        factory = self.factories.get(kind)
+        if factory is None:
+            return
+
+        if action == 'stop':
+            await interaction.response.edit_message(components=[])
+            return
+
+        source = await factory(interaction, key)
+        if source is None:
+            await interaction.response.send_message('Вы не можете управлять этим.', ephemeral=True)
+            return
+        await source._prepare_once()
+        if cursor and hasattr(source, 'seek'):
+            source.seek(int(target), cursor)
+        kwargs = await self.render(kind, key, source, int(target))
+        await interaction.response.edit_message(**kwargs)
+
+class BaseSource:
+    """Embed helpers, sources provide ``total_entries()``."""
     COLOR = 0x0084c7
+    per_page: int
+
     def base_embed(self, view: PaginatorView, entries) -> disnake.Embed:
         e = disnake.Embed(
             color=self.COLOR
         )
-        if self.is_paginating():
+        if self.is_paginating():  # type: ignore
             offset = view.current_page*self.per_page
             e.set_footer(
                 text=(
-                    f'Стр. {view.current_page+1}/{self.get_max_pages()} | '
-                    f'Показано {offset+1}-{offset+len(entries)}/{len(self.entries)}'
+                    f'Стр. {view.current_page+1}/{self.get_max_pages()} | '  # type: ignore
+                    f'Показано {offset+1}-{offset+len(entries)}/{self.total_entries()}'  # type: ignore
                 )
             )
-        return e
\ No newline at end of file
+        return e
+
+class BaseListSource(BaseSource, menus.ListPageSource):
+    def total_entries(self) -> int:
+        return len(self.entries)
+
+class AsyncPageSource(menus.PageSource):
+    """Page source that fetches pages on demand.
+
+    Pages around the last requested one are fetched in the background and
+    kept, farther ones are dropped. ``window=0`` disables that for one-shot
+    sources. Subclasses implement ``count`` and ``fetch``.
+    """
+    def __init__(self, *, per_page: int, window: int = 2):
+        self.per_page = per_page
+        self.window = window
+        self.total = 0
+        self._pages: Dict[int, asyncio.Future] = {}
+
+    async def count(self) -> int:
+        raise NotImplementedError
+
+    async def fetch(self, page_number: int) -> list:
+        raise NotImplementedError
+
+    async def prepare(self) -> None:
+        self.total = await self.count()
+
+    def is_paginating(self) -> bool:
+        return self.total > self.per_page
+
+    def get_max_pages(self) -> int:
+        return max(ceil(self.total / self.per_page), 1)
+
+    def total_entries(self) -> int:
+        return self.total
+
+    @staticmethod
+    def _failed(future: asyncio.Future) -> bool:
+        return future.done() and (future.cancelled() or future.exception() is not None)
+
+    def _page(self, page_number: int) -> asyncio.Future:
+        future = self._pages.get(page_number)
+        if future is None or self._failed(future):
+            future = self._pages[page_number] = asyncio.ensure_future(self.fetch(page_number))
+            # failed prefetches are retried on demand, don't log them
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        return future
+
+    def invalidate(self, page_number: Optional[int] = None) -> None:
+        if page_number is None:
+            pages = list(self._pages)
+        else:
+            pages = [page_number]
+        for number in pages:
+            future = self._pages.pop(number, None)
+            if future is not None:
+                future.cancel()
+
+    def cached_page(self, page_number: int) -> Optional[list]:
+        future = self._pages.get(page_number)
+        if future is None or not future.done() or self._failed(future):
+            return None
+        return future.result()
+
+    async def get_page(self, page_number: int) -> list:
+        if not 0 <= page_number < self.get_max_pages():
+            raise IndexError(page_number)
+        future = self._page(page_number)
+
+        for number in list(self._pages):
+            if abs(number - page_number) > self.window:
+                self._pages.pop(number).cancel()
+        if self.window:
+            for number in (page_number + 1, page_number - 1):
+                if 0 <= number < self.get_max_pages():
+                    self._page(number)
+
+        return await asyncio.shield(future)
+
+class KeysetPageSource(BaseSource, AsyncPageSource):
+    """Pages over a queryset ordered by ``(field, id)`` descending.
+
+    Neighbours of a known page are fetched with a keyset condition on
+    ``(field, id)``, only jumps to far pages fall back to an offset. Pages
+    can also be sought from a cursor, see ``StatelessPaginator``.
+    """
+    EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+    def __init__(self, queryset: QuerySet, *, per_page: int, field: str = 'created_at', window: int = 2):
+        super().__init__(per_page=per_page, window=window)
+        self.queryset = queryset
+        self.field = field
+        # page number -> ('a' or 'b', row) it comes right after or before
+        self._seeks: Dict[int, Tuple[str, Any]] = {}
+
+    def _encode(self, row) -> str:
+        value = getattr(row, self.field)
+        if isinstance(value, datetime):
+            epoch = self.EPOCH if value.tzinfo else self.EPOCH.replace(tzinfo=None)
+            value = (value - epoch) // timedelta(microseconds=1)
+        return f'{value}.{row.id}'
+
+    def _decode(self, cursor: str) -> SimpleNamespace:
+        value, id = cursor.split('.')
+        field = self.queryset.model._meta.fields_map[self.field]
+        if isinstance(field, DatetimeField):
+            decoded: Any = self.EPOCH + timedelta(microseconds=int(value))
+        else:
+            decoded = int(value)
+        return SimpleNamespace(**{self.field: decoded, 'id': int(id)})
+
+    def cursors(self, page: list) -> Tuple[str, str]:
+        """Cursors to the pages before and after ``page``."""
+        return f'b{self._encode(page[0])}', f'a{self._encode(page[-1])}'
+
+    def seek(self, page_number: int, cursor: str) -> None:
+        try:
+            self._seeks[page_number] = (cursor[0], self._decode(cursor[1:]))
+        except (ValueError, KeyError):
+            pass
+
+    async def count(self) -> int:
+        return await self.queryset.count()
+
+    def _after(self, row) -> Q:
+        value = getattr(row, self.field)
+        return Q(**{f'{self.field}__lt': value}) | Q(**{self.field: value, 'id__lt': row.id})
+
+    def _before(self, row) -> Q:
+        value = getattr(row, self.field)
+        return Q(**{f'{self.field}__gt': value}) | Q(**{self.field: value, 'id__gt': row.id})
+
+    async def fetch(self, page_number: int) -> list:
+        if page_number == 0:
+            return await self.queryset.order_by(f'-{self.field}', '-id').limit(self.per_page)
+
+        previous = self._pages.get(page_number - 1)
+        if previous is not None:
+            rows = await asyncio.shield(previous)
+            if rows:
+                return await self.queryset.filter(self._after(rows[-1])).order_by(
+                    f'-{self.field}', '-id'
+                ).limit(self.per_page)
+
+        seek = self._seeks.pop(page_number, None)
+        if seek is not None:
+            direction, row = seek
+            if direction == 'a':
+                return await self.queryset.filter(self._after(row)).order_by(
+                    f'-{self.field}', '-id'
+                ).limit(self.per_page)
+            rows = await self.queryset.filter(self._before(row)).order_by(self.field, 'id').limit(self.per_page)
+            return rows[::-1]
+
+        following = self.cached_page(page_number + 1)
+        if following:
+            rows = await self.queryset.filter(self._before(following[0])).order_by(
+                self.field, 'id'
+            ).limit(self.per_page)
+            return rows[::-1]
+
+        return await self.queryset.order_by(f'-{self.field}', '-id').offset(
+            page_number * self.per_page
+        ).limit(self.per_page)
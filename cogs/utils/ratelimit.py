@@ -0,0 +1,33 @@
+import asyncio
+from time import monotonic
+
+
+class RateLimiter:
+    """Token bucket allowing ``rate`` calls per ``per`` seconds."""
+
+    def __init__(self, rate: int, per: float) -> None:
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated = monotonic()
+
+    def delay(self) -> float:
+        """Take a token, or return how long to wait for one."""
+        now = monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) * self.per / self.rate
+
+    def retry_after(self, seconds: float) -> None:
+        """Drain the bucket after the API said we're going too fast."""
+        self.tokens = -seconds * self.rate / self.per
+
+    async def acquire(self) -> None:
+        while True:
+            delay = self.delay()
+            if not delay:
+                return
+            await asyncio.sleep(delay)
@@ -0,0 +1,68 @@
+import asyncio
+import heapq
+import traceback
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Generic, List, Optional, Tuple, TypeVar
+
+from disnake.utils import utcnow
+
+K = TypeVar("K")
+
+RETRY_DELAY = timedelta(seconds=30)
+
+
+class DeadlineScheduler(Generic[K]):
+    """Releases keys at their deadlines from a single task.
+
+    Deadlines live in a heap, the task sleeps until the earliest one and
+    hands everything that's due to ``release`` in batches. Keys are expected
+    to be persisted elsewhere and re-scheduled on startup.
+    """
+
+    def __init__(self, release: Callable[[List[K]], Awaitable[None]], *, batch: int = 500) -> None:
+        self.release = release
+        self.batch = batch
+        self.heap: List[Tuple[datetime, K]] = []
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def schedule(self, when: datetime, key: K) -> None:
+        heapq.heappush(self.heap, (when, key))
+        if self.heap[0][1] == key:
+            # new earliest deadline, the task has to sleep less
+            self.wakeup.set()
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self) -> None:
+        while True:
+            self.wakeup.clear()
+            now = utcnow()
+            due: List[K] = []
+            while self.heap and self.heap[0][0] <= now and len(due) < self.batch:
+                due.append(heapq.heappop(self.heap)[1])
+
+            if due:
+                try:
+                    await self.release(due)
+                except Exception as e:
+                    print(f"Could not release {len(due)} keys due to {e.__class__.__name__}: {e}")
+                    traceback.print_exception(type(e), e, e.__traceback__)
+                    for key in due:
+                        heapq.heappush(self.heap, (now + RETRY_DELAY, key))
+                continue
+
+            timeout = (self.heap[0][0] - now).total_seconds() if self.heap else None
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -1,12 +1,38 @@
 import random
-import pymorphy2  # type: ignore
+from functools import lru_cache
 
-morph = pymorphy2.MorphAnalyzer()
+
+@lru_cache(maxsize=None)
+def get_morph():
+    """Load the analyzer on first use, its dictionaries take a while and a lot of memory."""
+    import pymorphy2  # type: ignore
+
+    return pymorphy2.MorphAnalyzer()
+
+
+@lru_cache(maxsize=256)
+def _parse(word: str):
+    return get_morph().parse(word)[0]
+
+
+def _number_class(number: int) -> int:
+    """Smallest number with the same russian plural form as ``number``."""
+    number = abs(number)
+    if number % 10 == 1 and number % 100 != 11:
+        return 1
+    if 2 <= number % 10 <= 4 and not 12 <= number % 100 <= 14:
+        return 2
+    return 5
+
+
+@lru_cache(maxsize=1024)
+def _agree(word: str, number_class: int) -> str:
+    return _parse(word).make_agree_with_number(number_class).word
 
 
 class plural:
     def __init__(self, word: str) -> None:
-        self.word = morph.parse(word)[0]
+        self.word = word
 
     def __format__(self, __format_spec: str) -> str:
         try:
@@ -14,7 +40,7 @@ class plural:
         except ValueError:
             raise TypeError(f"format spec {__format_spec!r} must be a numeric")
 
-        return f"{str(spec)} {self.word.make_agree_with_number(spec).word}"
+        return f"{str(spec)} {_agree(self.word, _number_class(spec))}"
 
     def __repr__(self) -> str:
         return f"<plural word={self.word}>"
@@ -0,0 +1,67 @@
+import asyncio
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import disnake
+
+
+class WaiterRegistry:
+    """Replacement for ``bot.wait_for`` that routes events by key.
+
+    Every event is looked up by its key, so only the one matching waiter's
+    check runs, no matter how many flows are in progress. Keys are
+    ``("modal", custom_id)``, ``("message", channel_id, author_id)`` and
+    ``("reaction", message_id)``.
+    """
+
+    def __init__(self) -> None:
+        self._waiters: Dict[Hashable, Tuple[asyncio.Future, Optional[Callable[..., bool]]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._waiters)
+
+    async def wait(
+        self,
+        key: Hashable,
+        *,
+        check: Optional[Callable[..., bool]] = None,
+        timeout: Optional[float] = None,
+    ) -> Any:
+        """Wait for the event with ``key``, raises ``asyncio.TimeoutError`` like ``wait_for``.
+
+        A newer waiter for the same key replaces the older one, which gets cancelled.
+        """
+        previous = self._waiters.get(key)
+        if previous is not None:
+            previous[0].cancel()
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[key] = (future, check)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            current = self._waiters.get(key)
+            if current is not None and current[0] is future:
+                del self._waiters[key]
+
+    def resolve(self, key: Hashable, *args: Any) -> bool:
+        entry = self._waiters.get(key)
+        if entry is None:
+            return False
+        future, check = entry
+        if future.done() or (check is not None and not check(*args)):
+            return False
+        future.set_result(args[0] if len(args) == 1 else args)
+        return True
+
+    async def on_modal_submit(self, interaction: disnake.ModalInteraction) -> None:
+        self.resolve(("modal", interaction.custom_id), interaction)
+
+    async def on_message(self, message: disnake.Message) -> None:
+        self.resolve(("message", message.channel.id, message.author.id), message)
+
+    async def on_reaction_add(self, reaction: disnake.Reaction, user: disnake.User) -> None:
+        self.resolve(("reaction", reaction.message.id), reaction, user)
+
+    def setup(self, bot: disnake.Client) -> None:
+        for event in ("on_modal_submit", "on_message", "on_reaction_add"):
+            bot.add_listener(getattr(self, event), event)
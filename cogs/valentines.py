@@ -1,36 +1,249 @@
+from __future__ import annotations
 import asyncio
 import os
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Optional
 
 from disnake.ext import commands
 import disnake
-from tortoise.expressions import Q
+from tortoise.expressions import F, Q
+from tortoise.functions import Count
 
-from db.models import Valentines as ValentinesModel
-from .utils.paginator import PaginatorView, BaseListSource
+import db
+from db.models import Valentines as ValentinesModel, Delivery as DeliveryModel
+from .utils.cache import LRUCache
+from .utils.delivery import DeliveryQueue
+from .utils.scheduler import DeadlineScheduler
+from .utils.paginator import PaginatorView, BaseSource, AsyncPageSource, KeysetPageSource
 
+if TYPE_CHECKING:
+    from bot import Bot
 
-class ValentineSource(BaseListSource):
+
+class ValentinePages:
     COLOR = 0xEF66B8
-    def __init__(self, author_id: int, entries: list[ValentinesModel]):
-        super().__init__(entries, per_page=6)
-        self.author_id = author_id
+    author_id: int
 
     async def format_page(self, menu: PaginatorView, page: list[ValentinesModel]):
-        e = self.base_embed(menu, page)
+        e = self.base_embed(menu, page)  # type: ignore
         for row in page:
             name = f'{"анонимная " if row.anonymously else ""}валентинка'.capitalize()
+            if self.author_id == row.receiver and row.read_at is None:
+                name += ' (новая)'
             text = f'ID:`{row.id}`\n'
             if self.author_id == row.sender:
                 text += f'От: Вас\nКому: <@{row.receiver}>'
-            else:
+            elif self.author_id == row.receiver:
                 text += f'От: {f"<@{row.sender}>" if not row.anonymously else "анонима"}\nКому: Вам'
+            else:
+                text += f'От: {f"<@{row.sender}>" if not row.anonymously else "анонима"}\nКому: <@{row.receiver}>'
             text += f'\nОтправлена {disnake.utils.format_dt(row.created_at, "R")}'
             e.add_field(name=name, value=text)
         return e
 
+class ValentineSource(ValentinePages, KeysetPageSource):
+    def __init__(self, author_id: int, queryset, *, window: int = 2, total: Optional[int] = None):
+        super().__init__(queryset, per_page=6, window=window)
+        self.author_id = author_id
+        self.known_total = total
+
+    async def count(self) -> int:
+        if self.known_total is not None:
+            return self.known_total
+        return await super().count()
+
+class ValentineSearchSource(ValentinePages, BaseSource, AsyncPageSource):
+    """Full-text search results, best matches first.
+
+    SQLite uses the ``valentines_fts`` FTS5 table, Postgres the GIN index on
+    ``to_tsvector('russian', text)``, both are kept up to date by the database.
+    """
+    def __init__(self, author_id: int, query: str, *, is_owner: bool = False):
+        super().__init__(per_page=6)
+        self.author_id = author_id
+        self.query = query
+        self.is_owner = is_owner
+        self.conn = db.reader()
+        self.sqlite = self.conn.capabilities.dialect == 'sqlite'
+
+    def _match(self) -> tuple[str, str, list]:
+        """FROM and WHERE clauses with their values."""
+        # the same rules as in /valentine view
+        if self.is_owner:
+            access = '(v.released = {p} OR v.sender = {p})'
+            values: list = [True, self.author_id]
+        else:
+            access = '(v.sender = {p} OR (v.receiver = {p} AND v.released = {p}))'
+            values = [self.author_id, self.author_id, True]
+
+        if self.sqlite:
+            # every word is quoted, so user input can't use the FTS5 syntax, and matched as a prefix
+            terms = ' '.join('"{}"*'.format(word.replace('"', '""')) for word in self.query.split())
+            return (
+                'valentines_fts f JOIN valentines v ON v.id = f.rowid',
+                'valentines_fts MATCH {p} AND ' + access,
+                [terms, *values],
+            )
+        return (
+            'valentines v',
+            "to_tsvector('russian', v.text) @@ plainto_tsquery('russian', {p}) AND " + access,
+            [self.query, *values],
+        )
+
+    def _sql(self, template: str) -> str:
+        if self.sqlite:
+            return template.replace('{p}', '?')
+        parts = template.split('{p}')
+        return ''.join(part + (f'${i}' if i < len(parts) else '') for i, part in enumerate(parts, 1))
+
+    async def count(self) -> int:
+        if not self.query.split():
+            return 0
+        source, where, values = self._match()
+        rows = await self.conn.execute_query_dict(self._sql(f'SELECT COUNT(*) AS count FROM {source} WHERE {where}'), values)
+        return rows[0]['count']
+
+    async def fetch(self, page_number: int) -> list:
+        source, where, values = self._match()
+        if self.sqlite:
+            rank = 'bm25(valentines_fts)'
+        else:
+            rank = "-ts_rank(to_tsvector('russian', v.text), plainto_tsquery('russian', {p}))"
+            values = [*values, self.query]
+        sql = f'SELECT v.id FROM {source} WHERE {where} ORDER BY {rank}, v.id DESC LIMIT {{p}} OFFSET {{p}}'
+        values = [*values, self.per_page, page_number * self.per_page]
+        ids = [row['id'] for row in await self.conn.execute_query_dict(self._sql(sql), values)]
+        rows = {row.id: row for row in await ValentinesModel.filter(id__in=ids).using_db(self.conn)}
+        return [rows[id] for id in ids if id in rows]
+
+class Inbox:
+    """Member's valentine counters.
+
+    Updated on every write, so list headers and empty checks don't query the database.
+    """
+    __slots__ = ('sent', 'received', 'unread', 'own')
+
+    def __init__(self) -> None:
+        self.sent = 0
+        # released valentines only, scheduled ones are invisible to the receiver
+        self.received = 0
+        self.unread = 0
+        # sent to self, counted in both sent and received
+        self.own = 0
+
+    def total(self, type: str) -> int:
+        if type == 'receiver':
+            return self.received
+        if type == 'sender':
+            return self.sent
+        return self.sent + self.received - self.own
+
+MODAL_TIMEOUT = 15 * 60
+VIEW_CACHE_SIZE = 1024
+MSK = timezone(timedelta(hours=3))
+DELIVER_AT_FORMAT = '%d.%m.%Y %H:%M'
+
+
 class Valentines(commands.Cog):
-    def __init__(self, bot: commands.Bot) -> None:
+    def __init__(self, bot: Bot) -> None:
         self.bot = bot
+        self.bot.paginator.register('valentines', self.list_source)
+        self.delivery = DeliveryQueue(self.notify)
+        self.scheduler: DeadlineScheduler[int] = DeadlineScheduler(self.release)
+        self.inboxes: dict[int, Inbox] = {}
+        # until the counters are loaded lists count in the database
+        self.counted = False
+        # recently viewed valentines, only `released` and `read_at` ever change
+        self.rows: LRUCache[int, ValentinesModel] = LRUCache(VIEW_CACHE_SIZE)
+
+    async def cog_load(self) -> None:
+        # the database is set up in Bot.start, after cogs are loaded
+        await self.bot.wait_until_ready()
+        self.delivery.start()
+        scheduled = await ValentinesModel.filter(released=False).using_db(db.reader()).values_list('id', 'deliver_at')
+        for id, deliver_at in scheduled:
+            self.scheduler.schedule(deliver_at, id)
+        self.scheduler.start()
+        await self.count_inboxes()
+
+    def cog_unload(self) -> None:
+        self.bot.paginator.factories.pop('valentines', None)
+        self.delivery.stop()
+        self.scheduler.stop()
+
+    def inbox(self, member_id: int) -> Inbox:
+        inbox = self.inboxes.get(member_id)
+        if inbox is None:
+            inbox = self.inboxes[member_id] = Inbox()
+        return inbox
+
+    async def count_inboxes(self) -> None:
+        conn = db.reader()
+        released = ValentinesModel.filter(released=True).using_db(conn)
+        counts = (
+            ('sent', 'sender', ValentinesModel.all().using_db(conn)),
+            ('received', 'receiver', released),
+            ('unread', 'receiver', released.filter(read_at=None)),
+            ('own', 'sender', released.filter(sender=F('receiver'))),
+        )
+        self.inboxes.clear()
+        for counter, field, queryset in counts:
+            rows = await queryset.annotate(count=Count('id')).group_by(field).values_list(field, 'count')
+            for member_id, count in rows:
+                setattr(self.inbox(member_id), counter, count)
+        self.counted = True
+
+    def count_sent(self, row: ValentinesModel) -> None:
+        self.inbox(row.sender).sent += 1
+        if row.released:
+            self.count_received(row.sender, row.receiver)
+
+    def count_received(self, sender: int, receiver: int) -> None:
+        inbox = self.inbox(receiver)
+        inbox.received += 1
+        inbox.unread += 1
+        if sender == receiver:
+            inbox.own += 1
+
+    async def release(self, ids: list[int]) -> None:
+        """Hand scheduled valentines over to the delivery queue once their time has come."""
+        rows = await ValentinesModel.filter(id__in=ids, released=False).values_list('id', 'sender', 'receiver')
+        # queued before being marked, a crash in between is fixed by the delivery dedup
+        await self.delivery.enqueue_many([(id, receiver) for id, _, receiver in rows])
+        await ValentinesModel.filter(id__in=[id for id, _, _ in rows]).update(released=True)
+        for id, sender, receiver in rows:
+            self.rows.pop(id)
+            self.count_received(sender, receiver)
+
+    async def mark_read(self, row: ValentinesModel) -> None:
+        now = disnake.utils.utcnow()
+        row.read_at = now
+        if await ValentinesModel.filter(id=row.id, read_at=None).update(read_at=now):
+            self.inbox(row.receiver).unread -= 1
+
+    async def notify(self, delivery: DeliveryModel) -> None:
+        channel = await self.bot.create_dm(disnake.Object(delivery.recipient))
+        await channel.send(f'На ваш телефон пришло новое сообщение! Проверь, вдруг там что-то важное!'\
+            f' (`/valentine view id:{delivery.valentine_id}`, команду вводить на сервере, не покажется остальным в чате)')
+
+    def make_list_source(self, author_id: int, type: str) -> ValentineSource:
+        total = self.inbox(author_id).total(type) if self.counted else None
+        # receivers don't see scheduled valentines until they're delivered
+        received = Q(receiver=author_id, released=True)
+        if type == 'all':
+            q = Q(sender=author_id) | received
+        elif type == 'receiver':
+            q = received
+        else:
+            q = Q(sender=author_id)
+        # stateless paginators render one page per press, nothing to prefetch
+        return ValentineSource(author_id, ValentinesModel.filter(q).using_db(db.reader()), window=0, total=total)
+
+    async def list_source(self, inter: disnake.MessageInteraction, key: str) -> Optional[ValentineSource]:
+        author_id, type = key.split('.')
+        if inter.author.id not in (int(author_id), self.bot.owner_id):
+            return None
+        return self.make_list_source(int(author_id), type)
 
     @commands.slash_command()
     async def valentine(*_):
@@ -42,6 +255,7 @@ class Valentines(commands.Cog):
         inter: disnake.CommandInteraction,
         receiver: disnake.Member,
         anonymously: bool = True,
+        deliver_at: Optional[str] = None,
     ):
         """Отправить валентинку
         
@@ -49,6 +263,7 @@ class Valentines(commands.Cog):
         ----------
         receiver: Получатель валентинки
         anonymously: Отправить анонимно или нет?
+        deliver_at: Когда доставить, по Москве, например 14.02.2027 00:00 (сразу, по умолчанию)
         """
         if receiver == inter.author:
             return await inter.response.send_message('Вы не можете отправить себе валентинку.', ephemeral=True)
@@ -56,6 +271,14 @@ class Valentines(commands.Cog):
             return await inter.response.send_message('Вы не можете отправить валентинку боту.', ephemeral=True)
         if not inter.guild:
             return await inter.response.send_message('Эта команда работает только на сервере.', ephemeral=True)
+        when = None
+        if deliver_at is not None:
+            try:
+                when = datetime.strptime(deliver_at, DELIVER_AT_FORMAT).replace(tzinfo=MSK)
+            except ValueError:
+                return await inter.response.send_message('Дата должна быть в формате `14.02.2027 00:00`.', ephemeral=True)
+            if when <= inter.created_at:
+                return await inter.response.send_message('Эта дата уже прошла.', ephemeral=True)
 
         custom_id = os.urandom(16).hex()
         title = f'{"анонимная " if anonymously else ""}валентинка для '.capitalize() + receiver.display_name
@@ -71,20 +294,26 @@ class Valentines(commands.Cog):
                 ),
             ],
         )
-        def check(i: disnake.ModalInteraction):
-            return i.author == inter.author and i.custom_id == custom_id
-        modal_inter: disnake.ModalInteraction = await self.bot.wait_for('modal_submit', check=check)
+        try:
+            modal_inter: disnake.ModalInteraction = await self.bot.waiters.wait(
+                ('modal', custom_id), check=lambda i: i.author == inter.author, timeout=MODAL_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            return
         await modal_inter.response.send_message(
-            f'{title} была отправлена. '\
+            f'{title} {"будет доставлена " + disnake.utils.format_dt(when) if when else "была отправлена"}. '\
                 'Посмотреть список отправленных-полученных валентинок: `/valentine list`',
             ephemeral=True
         )
-        row = await ValentinesModel.create(sender=inter.author.id, receiver=receiver.id, anonymously=anonymously, text=modal_inter.text_values['text'])
-        try:
-            await receiver.send(f'На ваш телефон пришло новое сообщение! Проверь, вдруг там что-то важное!'\
-                f' (`/valentine view id:{row.id}`, команду вводить на сервере, не покажется остальным в чате)')
-        except disnake.HTTPException:
-            pass
+        row = await ValentinesModel.create(
+            sender=inter.author.id, receiver=receiver.id, anonymously=anonymously, text=modal_inter.text_values['text'],
+            deliver_at=when, released=when is None,
+        )
+        self.count_sent(row)
+        if when is None:
+            await self.delivery.enqueue(row.id, receiver.id)
+        else:
+            self.scheduler.schedule(when, row.id)
 
     @valentine.sub_command()
     async def list(
@@ -98,15 +327,29 @@ class Valentines(commands.Cog):
         ----------
         type: Какие валентинки показать?
         """
-        if type == 'all':
-            q = Q(**dict.fromkeys(('receiver', 'sender'), inter.author.id), join_type='OR')
-        else:
-            q = Q(**{type: inter.author.id})
-        
-        rows = await ValentinesModel.filter(q).order_by('-created_at')
-        if not len(rows):
+        source = self.make_list_source(inter.author.id, type)
+        await source._prepare_once()
+        if not source.total:
             return await inter.send('У вас нет валентинок.', ephemeral=True)
-        view = PaginatorView(ValentineSource(inter.author.id, rows), interaction=inter)
+        await self.bot.paginator.send(inter, 'valentines', f'{inter.author.id}.{type}', source, ephemeral=True)
+
+    @valentine.sub_command()
+    async def search(
+        self,
+        inter: disnake.CommandInteraction,
+        query: str,
+    ):
+        """Найти валентинки по тексту
+        
+        Parameters
+        ----------
+        query: Слова из текста валентинки
+        """
+        source = ValentineSearchSource(inter.author.id, query, is_owner=inter.author.id == self.bot.owner_id)
+        await source._prepare_once()
+        if not source.total:
+            return await inter.send('Ничего не найдено.', ephemeral=True)
+        view = PaginatorView(source, interaction=inter)
         await view.start(ephemeral=True)
 
     @valentine.sub_command()
@@ -121,8 +364,12 @@ class Valentines(commands.Cog):
         ----------
         id: ID валентинки
         """
-        row = await ValentinesModel.filter(id=id).first()
+        row = self.rows.get(id)
         if row is None:
+            row = await ValentinesModel.filter(id=id).using_db(db.reader()).first()
+            if row is not None:
+                self.rows[id] = row
+        if row is None or (not row.released and inter.author.id != row.sender):
             return await inter.response.send_message('Валентинки с таким ID не существует.')
 
         if inter.author.id not in (row.sender, row.receiver) and inter.author.id != self.bot.owner_id:
@@ -135,6 +382,8 @@ class Valentines(commands.Cog):
             e.add_field(name='Отправитель', value=f'<@{row.sender}>')
         e.add_field(name='Получатель', value=f'<@{row.receiver}>{" (анонимно)" if row.anonymously and row.sender == inter.author.id else ""}')
         await inter.response.send_message(embed=e, ephemeral=True)
+        if inter.author.id == row.receiver and row.read_at is None:
+            await self.mark_read(row)
     
     @commands.command(name='send')
     @commands.dm_only()
@@ -145,11 +394,11 @@ class Valentines(commands.Cog):
             return await ctx.reply('Вы не можете отправить валентинку боту.')
         m = await ctx.send('Отправить анонимно?')
         def r_check(r: disnake.Reaction, u: disnake.User):
-            return r.message == m and not u.bot and str(r.emoji) in ('\N{WHITE HEAVY CHECK MARK}', '\N{CROSS MARK}')
+            return not u.bot and str(r.emoji) in ('\N{WHITE HEAVY CHECK MARK}', '\N{CROSS MARK}')
         await m.add_reaction('\N{WHITE HEAVY CHECK MARK}')
         await m.add_reaction('\N{CROSS MARK}')
         try:
-            _: tuple[disnake.Reaction, disnake.User] = await self.bot.wait_for('reaction_add', check=r_check, timeout=30)
+            _: tuple[disnake.Reaction, disnake.User] = await self.bot.waiters.wait(('reaction', m.id), check=r_check, timeout=30)
             r, u = _
         except asyncio.TimeoutError:
             await m.edit(content='Слишком долго')
@@ -162,16 +411,14 @@ class Valentines(commands.Cog):
 
         await m.reply('У вас есть 5 минут, чтобы написать текст валентинки. Чтобы отменить, отправьте `-`.')
 
-        def check(m: disnake.Message):
-            return ctx.channel == m.channel and ctx.author == m.author
         try:
-            m_final: disnake.Message = await self.bot.wait_for('message', check=check)
+            m_final: disnake.Message = await self.bot.waiters.wait(('message', ctx.channel.id, ctx.author.id), timeout=300)
         except asyncio.TimeoutError:
             await m.edit(content='Вы не успели.')
             return
         if m_final.content == '-':
             return await m_final.reply('Отмена.')
-        e = disnake.Embed(description=m.content)
+        e = disnake.Embed(description=m_final.content)
         e.add_field(name='Отправитель', value='Аноним' if anonymously else ctx.author.mention)
         e.add_field(name='Получатель', value=receiver.mention)
 
@@ -179,7 +426,7 @@ class Valentines(commands.Cog):
         await m.add_reaction('\N{WHITE HEAVY CHECK MARK}')
         await m.add_reaction('\N{CROSS MARK}')
         try:
-            _: tuple[disnake.Reaction, disnake.User] = await self.bot.wait_for('reaction_add', check=r_check, timeout=30)
+            _: tuple[disnake.Reaction, disnake.User] = await self.bot.waiters.wait(('reaction', m.id), check=r_check, timeout=30)
             r, u = _
         except asyncio.TimeoutError:
             await m.edit(content='Слишком долго')
@@ -193,16 +440,24 @@ class Valentines(commands.Cog):
                 'Посмотреть список отправленных-полученных валентинок: `/valentine list`',
         )
         row = await ValentinesModel.create(sender=ctx.author.id, receiver=receiver.id, anonymously=anonymously, text=m_final.content)
-        try:
-            await receiver.send(f'На ваш телефон пришло новое сообщение! Проверь, вдруг там что-то важное!'\
-                f' (`/valentine view id:{row.id}`, команду вводить на сервере, не покажется остальным в чате)')
-        except disnake.HTTPException:
-            pass
+        self.count_sent(row)
+        await self.delivery.enqueue(row.id, receiver.id)
 
     @text_send.error
     async def text_send_error(self, ctx, error):
         if isinstance(error, commands.CheckFailure):
             await ctx.reply('только в лс ок?')
 
+    @commands.command(name='deliveries')
+    @commands.is_owner()
+    async def deliveries(self, ctx: commands.Context):
+        stats = await self.delivery.stats()
+        await ctx.reply(
+            f'В очереди: {stats["pending"]} (пора отправить: {stats["due"]}, отправляются: {stats["in_flight"]})\n'
+            f'Отправлено: {stats["sent"]}, за последний час: {stats["sent_last_hour"]}\n'
+            f'Не доставлено: {stats["failed"]}\n'
+            f'Скорость: {stats["per_minute"]:.1f}/мин'
+        )
+
 def setup(bot):
     bot.add_cog(Valentines(bot))
\ No newline at end of file
@@ -1,19 +1,261 @@
 from __future__ import annotations
-from typing import TYPE_CHECKING
+import asyncio
+from collections import deque
+from time import monotonic
+from typing import TYPE_CHECKING, Iterable, Optional
 
-from disnake.ext import commands
+from disnake.ext import commands, tasks
 import disnake
 
+from db.models import VoiceRoom
+
 if TYPE_CHECKING:
     from bot import Bot
 
 CATEGORY_ID = 836670303266144306
 BASE_CHANNEL_ID = 930477492211437618
+# hidden empty rooms kept ready, so joining the base channel costs no channel creation
+POOL_SIZE = 3
+POOL_NAME = "\N{HOURGLASS WITH FLOWING SAND}"
+REFILL_RETRY = 30
+# empty rooms live this long, so a quick re-join keeps the room
+GRACE = 15
+SWEEP_INTERVAL = 5
+
+
+class Room:
+    __slots__ = ("channel_id", "owner_id", "occupants")
+
+    def __init__(self, channel_id: int, owner_id: Optional[int] = None) -> None:
+        self.channel_id = channel_id
+        self.owner_id = owner_id
+        self.occupants: set[int] = set()
+
+class RoomRegistry:
+    """Managed rooms by channel and by owner, mirrored to the ``VoiceRoom`` table.
+
+    Occupants are tracked from voice state updates, so ownership and
+    emptiness checks don't walk the guild's voice states.
+    """
+    def __init__(self) -> None:
+        self.rooms: dict[int, Room] = {}
+        self.owners: dict[int, Room] = {}
+
+    def __contains__(self, channel_id: int) -> bool:
+        return channel_id in self.rooms
+
+    def get(self, channel_id: int) -> Optional[Room]:
+        return self.rooms.get(channel_id)
+
+    def owned(self, owner_id: int) -> Optional[Room]:
+        return self.owners.get(owner_id)
+
+    def _put(self, room: Room) -> None:
+        self.rooms[room.channel_id] = room
+        if room.owner_id is not None:
+            self.owners[room.owner_id] = room
+
+    async def load(self) -> None:
+        self.rooms.clear()
+        self.owners.clear()
+        for channel_id, owner_id in await VoiceRoom.all().values_list("channel_id", "owner_id"):
+            self._put(Room(channel_id, owner_id))
+
+    async def add(self, channel_id: int, owner_id: Optional[int] = None) -> Room:
+        await VoiceRoom.create(channel_id=channel_id, owner_id=owner_id)
+        room = Room(channel_id, owner_id)
+        self._put(room)
+        return room
+
+    async def set_owner(self, room: Room, owner_id: int) -> None:
+        await VoiceRoom.filter(channel_id=room.channel_id).update(owner_id=owner_id)
+        if room.owner_id is not None:
+            self.owners.pop(room.owner_id, None)
+        room.owner_id = owner_id
+        self.owners[owner_id] = room
+
+    async def remove(self, channel_ids: Iterable[int]) -> None:
+        ids = []
+        for channel_id in channel_ids:
+            room = self.rooms.pop(channel_id, None)
+            if room is None:
+                continue
+            ids.append(channel_id)
+            if room.owner_id is not None and self.owners.get(room.owner_id) is room:
+                del self.owners[room.owner_id]
+        if ids:
+            await VoiceRoom.filter(channel_id__in=ids).delete()
+
+    def join(self, channel_id: int, member_id: int) -> bool:
+        room = self.rooms.get(channel_id)
+        if room is None:
+            return False
+        room.occupants.add(member_id)
+        return True
+
+    def leave(self, channel_id: int, member_id: int) -> Optional[Room]:
+        """Room that became empty, if any."""
+        room = self.rooms.get(channel_id)
+        if room is None:
+            return None
+        room.occupants.discard(member_id)
+        return None if room.occupants else room
 
 
 class VoiceRooms(commands.Cog, name="Войсчаты"):  # type: ignore
     def __init__(self, bot: Bot) -> None:
         self.bot = bot
+        self.registry = RoomRegistry()
+        self.pool: deque[disnake.VoiceChannel] = deque()
+        self.pool_ids: set[int] = set()
+        # members whose room is being set up, re-joins meanwhile are ignored
+        self.claiming: set[int] = set()
+        # channel id -> monotonic deadline, deleted in batches by the sweeper
+        self.doomed: dict[int, float] = {}
+        self.wake = asyncio.Event()
+        self.refill_task: Optional[asyncio.Task] = None
+
+    async def cog_load(self) -> None:
+        # the database is set up in Bot.start, after cogs are loaded
+        await self.bot.wait_until_ready()
+        await self.registry.load()
+        category = self.bot.get_channel(CATEGORY_ID)
+        if not isinstance(category, disnake.CategoryChannel):
+            return
+        await self.reconcile(category)
+        self.refill_task = asyncio.create_task(self.refill(category))
+        self.sweeper.start()
+
+    def cog_unload(self) -> None:
+        if self.refill_task is not None:
+            self.refill_task.cancel()
+        self.sweeper.cancel()
+
+    async def reconcile(self, category: disnake.CategoryChannel) -> None:
+        """Sync the registry with the category after being offline."""
+        live = {channel.id: channel for channel in category.voice_channels if channel.id != BASE_CHANNEL_ID}
+        await self.registry.remove([channel_id for channel_id in self.registry.rooms if channel_id not in live])
+
+        orphans = []
+        for channel in live.values():
+            room = self.registry.get(channel.id)
+            if room is None:
+                if not channel.members and channel.name != POOL_NAME:
+                    orphans.append(channel)
+                    continue
+                # occupied rooms go once everyone leaves, pooled ones from before the registry are kept
+                room = await self.registry.add(channel.id)
+            room.occupants = {member.id for member in channel.members}
+            if room.occupants:
+                continue
+            if room.owner_id is None and channel.name == POOL_NAME:
+                self.put(channel)
+            else:
+                orphans.append(channel)
+        await self.delete_rooms(orphans)
+
+    async def delete_rooms(self, channels: list[disnake.VoiceChannel]) -> None:
+        if not channels:
+            return
+        await asyncio.gather(*(channel.delete() for channel in channels), return_exceptions=True)
+        await self.registry.remove(channel.id for channel in channels)
+
+    @tasks.loop(seconds=SWEEP_INTERVAL)
+    async def sweeper(self):
+        now = monotonic()
+        due = [channel_id for channel_id, deadline in self.doomed.items() if deadline <= now]
+        channels = []
+        for channel_id in due:
+            del self.doomed[channel_id]
+            channel = self.bot.get_channel(channel_id)
+            if channel is None:
+                await self.registry.remove([channel_id])
+            elif not channel.members:  # type: ignore
+                channels.append(channel)
+        await self.delete_rooms(channels)
+
+    def put(self, channel: disnake.VoiceChannel) -> None:
+        self.pool.append(channel)
+        self.pool_ids.add(channel.id)
+
+    def take(self) -> Optional[disnake.VoiceChannel]:
+        if not self.pool:
+            return None
+        channel = self.pool.popleft()
+        self.pool_ids.discard(channel.id)
+        self.wake.set()
+        return channel
+
+    async def refill(self, category: disnake.CategoryChannel) -> None:
+        while True:
+            while len(self.pool) < POOL_SIZE:
+                try:
+                    channel = await category.guild.create_voice_channel(
+                        POOL_NAME,
+                        category=category,
+                        overwrites={
+                            category.guild.default_role: disnake.PermissionOverwrite(view_channel=False)
+                        },
+                    )
+                except disnake.HTTPException:
+                    await asyncio.sleep(REFILL_RETRY)
+                    continue
+                await self.registry.add(channel.id)
+                self.put(channel)
+            self.wake.clear()
+            await self.wake.wait()
+
+    async def claim(self, member: disnake.Member) -> None:
+        # back to the room they already have
+        room = self.registry.owned(member.id)
+        if room is not None:
+            channel = self.bot.get_channel(room.channel_id)
+            if isinstance(channel, disnake.VoiceChannel):
+                await member.move_to(channel)
+                return
+
+        overwrites = {
+            member: disnake.PermissionOverwrite(
+                manage_channels=True, speak=True, connect=True
+            )
+        }
+        while (channel := self.take()) is not None:
+            # both calls go out together, the member doesn't wait for the rename
+            edited, moved = await asyncio.gather(
+                channel.edit(name=member.display_name, overwrites=overwrites),
+                member.move_to(channel),
+                return_exceptions=True,
+            )
+            if isinstance(edited, disnake.NotFound):
+                # deleted by hand, try the next one
+                continue
+            room = self.registry.get(channel.id)
+            if room is not None:
+                await self.registry.set_owner(room, member.id)
+            if isinstance(moved, Exception):
+                # left the base channel already, nobody would ever leave this room
+                await self.delete_rooms([channel])
+            if isinstance(edited, Exception):
+                raise edited
+            return
+
+        ch = await member.guild.create_voice_channel(
+            member.display_name,
+            category=disnake.Object(CATEGORY_ID),  # type: ignore
+            overwrites=overwrites,  # type: ignore
+        )
+        await self.registry.add(ch.id, member.id)
+        await member.move_to(ch)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel: disnake.abc.GuildChannel):
+        if channel.id in self.pool_ids:
+            self.pool.remove(channel)  # type: ignore
+            self.pool_ids.discard(channel.id)
+            self.wake.set()
+        if channel.id in self.registry:
+            self.doomed.pop(channel.id, None)
+            await self.registry.remove([channel.id])
 
     @commands.Cog.listener()
     async def on_voice_state_update(
@@ -22,24 +264,24 @@ class VoiceRooms(commands.Cog, name="Войсчаты"):  # type: ignore
         before: disnake.VoiceState,
         after: disnake.VoiceState,
     ):
-        if (
-            before.channel
-            and before.channel.category_id == CATEGORY_ID
-            and before.channel.id != BASE_CHANNEL_ID
-            and not len(before.channel.members)
-        ):
-            await before.channel.delete()
-        if after.channel and after.channel.id == BASE_CHANNEL_ID:
-            ch = await member.guild.create_voice_channel(
-                member.display_name,
-                category=disnake.Object(CATEGORY_ID),  # type: ignore
-                overwrites={
-                    member: disnake.PermissionOverwrite(
-                        manage_channels=True, speak=True, connect=True
-                    )
-                },
-            )
-            await member.move_to(ch)
+        # mute and deafen updates keep the channel
+        if before.channel == after.channel:
+            return
+        if before.channel:
+            room = self.registry.leave(before.channel.id, member.id)
+            if room is not None and room.channel_id not in self.pool_ids:
+                self.doomed[room.channel_id] = monotonic() + GRACE
+        if after.channel:
+            if self.registry.join(after.channel.id, member.id):
+                self.doomed.pop(after.channel.id, None)
+            if after.channel.id == BASE_CHANNEL_ID:
+                if member.id in self.claiming:
+                    return
+                self.claiming.add(member.id)
+                try:
+                    await self.claim(member)
+                finally:
+                    self.claiming.discard(member.id)
 
 
 def setup(bot):
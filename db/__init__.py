@@ -1,14 +1,99 @@
+import os
+
 from tortoise import Tortoise
+from tortoise.backends.base.config_generator import expand_db_url
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+from .migrations import migrate
+
+DEFAULT_URL = "sqlite://db/files/db.sqlite"
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    # WAL makes NORMAL durable against application crashes, only an OS crash may lose the last commits
+    "synchronous": "NORMAL",
+    "foreign_keys": "ON",
+    "cache_size": -32000,  # KiB
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
+POSTGRES_ENGINES = ("tortoise.backends.asyncpg", "tortoise.backends.psycopg")
+
+
+def _connection(url: str, *, read_only: bool = False) -> dict:
+    """Tortoise connection config for ``url``.
 
+    SQLite gets the tuned pragmas, Postgres (needs ``asyncpg``) gets a pool
+    sized by ``DB_POOL_MIN``/``DB_POOL_MAX`` and a prepared statement cache
+    sized by ``DB_STATEMENT_CACHE``.
+    """
+    if url.startswith("sqlite://"):
+        credentials = {"file_path": url[len("sqlite://"):], **SQLITE_PRAGMAS}
+        if read_only:
+            credentials["query_only"] = "ON"
+        return {"engine": "tortoise.backends.sqlite", "credentials": credentials}
+
+    config = expand_db_url(url)
+    if config["engine"] in POSTGRES_ENGINES:
+        credentials = config["credentials"]
+        credentials.setdefault("minsize", int(os.environ.get("DB_POOL_MIN", 2)))
+        credentials.setdefault("maxsize", int(os.environ.get("DB_POOL_MAX", 10)))
+        if read_only:
+            credentials.setdefault("server_settings", {})["default_transaction_read_only"] = "on"
+        if config["engine"] == "tortoise.backends.asyncpg":
+            credentials.setdefault("statement_cache_size", int(os.environ.get("DB_STATEMENT_CACHE", 256)))
+    return config
+
+
+DB_URL = os.environ.get("DB_URL", DEFAULT_URL)
 TORTOISE_ORM = {
     "apps": {"models": {"models": ["db.models"], "default_connection": "master"}},
-    "connections": {"master": "sqlite://db/files/db.sqlite"},
+    "connections": {
+        "master": _connection(DB_URL),
+        # separate connection for reads, so they don't queue behind session writes,
+        # may point to a replica
+        "reader": _connection(os.environ.get("DB_READ_URL", DB_URL), read_only=True),
+    },
 }
 
 
-async def init(reconnect=False, regenerate=False):
+def reader() -> BaseDBAsyncClient:
+    """Connection for read-only queries, pass it to ``.using_db()``."""
+    return Tortoise.get_connection("reader")
+
+
+def master() -> BaseDBAsyncClient:
+    return Tortoise.get_connection("master")
+
+
+async def connect(reconnect=False):
     if reconnect:
         await Tortoise.close_connections()
     await Tortoise.init(config=TORTOISE_ORM)
-    if regenerate:
-        await Tortoise.generate_schemas()
+
+
+async def init():
+    """Connect and bring the schema up to date, called once at startup."""
+    await connect()
+    await migrate(master())
+
+
+async def ping() -> bool:
+    try:
+        for conn in (master(), reader()):
+            await conn.execute_query("SELECT 1")
+    except Exception:
+        return False
+    return True
+
+
+async def check() -> bool:
+    """Reconnect if the connections are broken, returns whether it did."""
+    if await ping():
+        return False
+    await connect(reconnect=True)
+    return True
+
+
+async def close():
+    await Tortoise.close_connections()
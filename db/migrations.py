@@ -0,0 +1,168 @@
+"""Versioned schema migrations.
+
+Every migration runs once, in order, and the applied version is stored in
+the ``schema_version`` table. New models are created by ``create_tables``:
+add a migration calling it with the new model, new columns go through
+``add_column``. Indexes declared in ``db.models`` are created once all
+pending migrations ran, when every column they need exists. Migrations are
+not wrapped in a transaction, so they have to be safe to re-run after a
+partial failure.
+"""
+from __future__ import annotations
+from datetime import date
+from typing import Awaitable, Callable, Type
+
+from tortoise.backends.base.client import BaseDBAsyncClient
+from tortoise.models import Model
+from tortoise.transactions import in_transaction
+from tortoise.utils import generate_schema_for_client
+
+Migration = Callable[[BaseDBAsyncClient], Awaitable[None]]
+MIGRATIONS: list[Migration] = []
+
+
+def migration(func: Migration) -> Migration:
+    MIGRATIONS.append(func)
+    return func
+
+
+async def table_exists(conn: BaseDBAsyncClient, table: str) -> bool:
+    if conn.capabilities.dialect == "sqlite":
+        rows = await conn.execute_query_dict(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", [table]
+        )
+    else:
+        rows = await conn.execute_query_dict(
+            "SELECT 1 FROM information_schema.tables WHERE table_schema = current_schema() AND table_name = $1",
+            [table],
+        )
+    return bool(rows)
+
+
+async def create_tables(conn: BaseDBAsyncClient, *models: Type[Model]) -> None:
+    """Create the tables of ``models`` that don't exist yet, referenced models first.
+
+    Tables already there are left alone, their new columns and indexes come
+    from later migrations and the final pass of ``migrate``.
+    """
+    generator = conn.schema_generator(conn)
+    for model in models:
+        if await table_exists(conn, model._meta.db_table):
+            continue
+        await conn.execute_script(generator._get_table_sql(model, safe=True)["table_creation_string"])
+
+
+async def add_column(conn: BaseDBAsyncClient, table: str, column: str, sqlite: str, postgres: str) -> None:
+    """Add a column unless it's there, the types are given per dialect.
+
+    Indexes on the column are created by ``migrate`` after the last migration.
+    """
+    if conn.capabilities.dialect == "sqlite":
+        columns = await conn.execute_query_dict(f'PRAGMA table_info("{table}")')
+        if any(c["name"] == column for c in columns):
+            return
+        await conn.execute_script(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {sqlite}')
+    else:
+        await conn.execute_script(f'ALTER TABLE "{table}" ADD COLUMN IF NOT EXISTS "{column}" {postgres}')
+
+
+@migration
+async def initial(conn: BaseDBAsyncClient) -> None:
+    from .models import Member, Score, ScoreDay, Valentines
+
+    await create_tables(conn, Member, Score, ScoreDay, Valentines)
+    # score tables from before compaction have no snapshot flag
+    await add_column(conn, "score", "snapshot", "INT NOT NULL DEFAULT 0", "BOOL NOT NULL DEFAULT FALSE")
+
+
+@migration
+async def backfill_score_days(conn: BaseDBAsyncClient) -> None:
+    from .models import Score, ScoreDay
+
+    days: dict[tuple[int, date], int] = {}
+    for member_id, started_at, score in await Score.filter(dumped=False).using_db(conn).values_list(
+        "member_id", "started_at", "score"
+    ):
+        key = (member_id, started_at.date())
+        days[key] = days.get(key, 0) + score
+    # rebuilt from scratch in one transaction, so a re-run after a failure doesn't count rows twice
+    async with in_transaction(conn.connection_name) as tx:
+        await ScoreDay.all().using_db(tx).delete()
+        await ScoreDay.bulk_create(
+            [ScoreDay(member_id=member_id, day=day, score=score) for (member_id, day), score in days.items()],
+            batch_size=500,
+            using_db=tx,
+        )
+
+
+@migration
+async def deliveries(conn: BaseDBAsyncClient) -> None:
+    from .models import Delivery
+
+    await create_tables(conn, Delivery)
+
+
+@migration
+async def scheduled_valentines(conn: BaseDBAsyncClient) -> None:
+    await add_column(conn, "valentines", "deliver_at", "TIMESTAMP", "TIMESTAMPTZ")
+    await add_column(conn, "valentines", "released", "INT NOT NULL DEFAULT 1", "BOOL NOT NULL DEFAULT TRUE")
+
+
+@migration
+async def valentines_search(conn: BaseDBAsyncClient) -> None:
+    if conn.capabilities.dialect != "sqlite":
+        await conn.execute_script(
+            "CREATE INDEX IF NOT EXISTS valentines_text_fts ON valentines USING GIN (to_tsvector('russian', text))"
+        )
+        return
+    # external content table, triggers keep it in sync with `valentines`
+    await conn.execute_script(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS valentines_fts USING fts5(
+            text, content='valentines', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+        );
+        CREATE TRIGGER IF NOT EXISTS valentines_fts_insert AFTER INSERT ON valentines BEGIN
+            INSERT INTO valentines_fts (rowid, text) VALUES (new.id, new.text);
+        END;
+        CREATE TRIGGER IF NOT EXISTS valentines_fts_delete AFTER DELETE ON valentines BEGIN
+            INSERT INTO valentines_fts (valentines_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        END;
+        CREATE TRIGGER IF NOT EXISTS valentines_fts_update AFTER UPDATE OF text ON valentines BEGIN
+            INSERT INTO valentines_fts (valentines_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            INSERT INTO valentines_fts (rowid, text) VALUES (new.id, new.text);
+        END;
+        INSERT INTO valentines_fts (valentines_fts) VALUES ('rebuild');
+        """
+    )
+
+
+@migration
+async def valentine_read_at(conn: BaseDBAsyncClient) -> None:
+    await add_column(conn, "valentines", "read_at", "TIMESTAMP", "TIMESTAMPTZ")
+
+
+@migration
+async def voice_rooms(conn: BaseDBAsyncClient) -> None:
+    from .models import VoiceRoom
+
+    await create_tables(conn, VoiceRoom)
+
+
+async def migrate(conn: BaseDBAsyncClient) -> None:
+    await conn.execute_script(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INT NOT NULL PRIMARY KEY, "
+        "applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+    )
+    rows = await conn.execute_query_dict("SELECT MAX(version) AS version FROM schema_version")
+    current = rows[0]["version"] or 0
+    if current >= len(MIGRATIONS):
+        return
+    for version, func in enumerate(MIGRATIONS, 1):
+        if version <= current:
+            continue
+        print(f"Applying migration {version} ({func.__name__})")
+        await func(conn)
+        await conn.execute_script(f"INSERT INTO schema_version (version) VALUES ({version})")
+    # every column exists now, create the indexes the models declare
+    await generate_schema_for_client(conn, safe=True)
@@ -11,6 +11,8 @@ from tortoise.fields import (
     ReverseRelation,
     BooleanField,
     TextField,
+    DateField,
+    CharField,
 )
 
 
@@ -18,13 +20,33 @@ class Member(Model):
     id = BigIntField(pk=True)
 
     scores: ReverseRelation["Score"]
+    score_days: ReverseRelation["ScoreDay"]
 
 class Score(Model):
     member: ForeignKeyRelation[Member] = ForeignKeyField("models.Member", "scores")
     score = IntField()
     started_at = DatetimeField()
     ended_at = DatetimeField(auto_now_add=True)
+    # folded into a snapshot by the compactor, kept as history and left out of totals
     dumped = BooleanField(default=False)
+    # per member per day sum of dumped sessions
+    snapshot = BooleanField(default=False)
+
+    class Meta:
+        indexes = (
+            ("member_id", "started_at"),
+            ("started_at",),
+            ("dumped", "ended_at"),
+        )
+
+class ScoreDay(Model):
+    """Sum of member's scores per UTC day, by the day sessions started."""
+    member: ForeignKeyRelation[Member] = ForeignKeyField("models.Member", "score_days")
+    day = DateField()
+    score = IntField(default=0)
+
+    class Meta:
+        unique_together = (("member", "day"),)
 
 class Valentines(Model):
     sender = BigIntField()
@@ -32,3 +54,43 @@ class Valentines(Model):
     anonymously = BooleanField()
     text = TextField()
     created_at = DatetimeField(auto_now_add=True)
+    # scheduled valentines are hidden from the receiver and not delivered until released
+    deliver_at = DatetimeField(null=True)
+    released = BooleanField(default=True)
+    # first time the receiver opened it with /valentine view
+    read_at = DatetimeField(null=True)
+
+    deliveries: ReverseRelation["Delivery"]
+
+    class Meta:
+        indexes = (
+            ("sender", "created_at"),
+            ("receiver", "created_at"),
+            ("created_at",),
+            ("released", "deliver_at"),
+        )
+
+class Delivery(Model):
+    """Outbound DM notification about a valentine, processed by the delivery queue."""
+    PENDING = "pending"
+    SENT = "sent"
+    FAILED = "failed"
+
+    valentine: ForeignKeyRelation[Valentines] = ForeignKeyField("models.Valentines", "deliveries")
+    recipient = BigIntField()
+    status = CharField(max_length=8, default=PENDING)
+    attempts = IntField(default=0)
+    next_attempt_at = DatetimeField()
+    created_at = DatetimeField(auto_now_add=True)
+    sent_at = DatetimeField(null=True)
+    error = TextField(null=True)
+
+    class Meta:
+        unique_together = (("valentine", "recipient"),)
+        indexes = (("status", "next_attempt_at"),)
+
+class VoiceRoom(Model):
+    """Temporary voice channel managed by the voice rooms cog, ``owner_id`` is None for pooled rooms."""
+    channel_id = BigIntField(pk=True)
+    owner_id = BigIntField(null=True, index=True)
+    created_at = DatetimeField(auto_now_add=True)
@@ -1,9 +1,11 @@
 import os
-from bot import Bot
 
 if not "TOKEN" in os.environ:
     from dotenv import load_dotenv
 
     load_dotenv()
 
+# the database config is read from the environment on import
+from bot import Bot
+
 Bot().run(token=os.environ["TOKEN"])